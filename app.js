@@ -24,7 +24,11 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!response.ok) {
                 throw new Error(`Failed to fetch stock_status.json. Status: ${response.status}. Make sure the file exists in your repository and the GitHub Action has run at least once.`);
             }
-            const products = await response.json();
+            const status = await response.json();
+            // Multi-pincode runs store { pincode: { product: bool } }; list every product once.
+            const products = Object.values(status).some(v => typeof v === 'object' && v !== null)
+                ? Object.assign({}, ...Object.values(status))
+                : status;
             const productNames = Object.keys(products).sort();
 
             if (productNames.length === 0) {
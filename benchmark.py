@@ -0,0 +1,248 @@
+"""Benchmarks a full stock check against a local mock of shop.amul.com.
+
+The mock storefront serves the recorded ms.products fixture in benchmarks/fixtures,
+scaled up to the requested catalog sizes, so no request ever reaches the real site.
+
+    python benchmark.py                          # direct HTTP engine, 30 / 1k / 50k products
+    python benchmark.py --engine selenium        # headless Chrome (needs Chrome installed)
+    python benchmark.py --sizes 30 1000 --repeat 5 --json bench.json
+    python benchmark.py --engine selenium --log-profile full network   # performance log volume per profile
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import main
+from main import LOG_PROFILES, AmulAPIClient, AmulHTTPClient, RunReport, StockMonitor
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "ms_products_protein.json")
+PINCODE = "400001"
+SUBSTORE = "mock-store"
+PHASES = ("driver_startup", "pincode_selection", "page_load", "log_parsing", "diffing", "state_save")
+# Performance log volume chromedriver had to buffer and hand over (selenium engine only).
+TRANSFERS = ("log_events_transferred", "log_bytes_transferred")
+
+HOME_PAGE = """<!doctype html>
+<html><body>
+<div id="modal">
+  <input placeholder="Enter Your Pincode">
+  <div id="results"></div>
+</div>
+<div class="pincode_wrap"><span class="ms-2 fw-semibold"></span></div>
+<script>
+const input = document.querySelector('input');
+input.addEventListener('input', () => {
+  if (input.value.length !== 6) return;
+  document.getElementById('results').innerHTML =
+    '<div class="list-group-item text-left searchproduct-name"><a class="searchitem-name" href="#">' + input.value + '</a></div>';
+  document.querySelector('a.searchitem-name').addEventListener('click', async (e) => {
+    e.preventDefault();
+    await fetch('/entity/ms.settings/_/setPreferences', {
+      method: 'PUT', headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({data: {store: '%(substore)s'}}),
+    });
+    document.getElementById('modal').remove();
+    document.querySelector('.pincode_wrap span').textContent = input.value;
+  });
+});
+</script>
+</body></html>
+"""
+
+BROWSE_PAGE = """<!doctype html>
+<html><body>
+<div id="products"></div>
+<script>
+fetch('/api/1/entity/ms.products?fields[name]=1&fields[alias]=1&filters[0][field]=categories'
+      + '&filters[0][value][0]=%(category)s&filters[0][operator]=in&limit=32&start=0&total=1&substore=%(substore)s')
+  .then(r => r.json())
+  .then(d => { document.getElementById('products').textContent = d.data.length + ' products'; });
+</script>
+</body></html>
+"""
+
+
+def build_catalog(size: int) -> Dict[str, Any]:
+    """Scales the recorded fixture to size products by cloning records with unique aliases."""
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+    records = fixture["data"]
+    data = []
+    for i in range(size):
+        record = dict(records[i % len(records)])
+        if i >= len(records):
+            record["alias"] = f"{record['alias']}-{i}"
+            record["name"] = f"{record['name']} #{i}"
+        data.append(record)
+    return {"messages": fixture.get("messages", []), "fileBaseUrl": fixture.get("fileBaseUrl"), "data": data}
+
+
+class MockStorefrontHandler(BaseHTTPRequestHandler):
+    catalog: Dict[str, Any] = {}
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, body: str, content_type: str = "application/json") -> None:
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Set-Cookie", "jsessionid=mock; Path=/")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path in ("/en/", "/en"):
+            self._send(HOME_PAGE % {"substore": SUBSTORE}, "text/html")
+        elif url.path.startswith("/en/browse/"):
+            category = url.path.rsplit("/", 1)[-1]
+            self._send(BROWSE_PAGE % {"category": category, "substore": SUBSTORE}, "text/html")
+        elif url.path == "/user/info.js":
+            self._send("session = {};", "application/javascript")
+        elif url.path == "/entity/pincode":
+            pincode = query.get("filters[0][value]", [PINCODE])[0]
+            self._send(json.dumps({"records": [{"pincode": pincode, "substore": SUBSTORE}]}))
+        elif url.path == "/api/1/entity/ms.products":
+            start = int(query.get("start", ["0"])[0])
+            limit = int(query.get("limit", ["32"])[0])
+            data = self.catalog["data"]
+            page = dict(self.catalog, data=data[start:start + limit])
+            page["paging"] = {"limit": limit, "start": start, "count": len(page["data"]), "total": len(data)}
+            self._send(json.dumps(page))
+        else:
+            self.send_error(404)
+
+    def do_PUT(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._send(json.dumps({"data": {"store": SUBSTORE}}))
+
+
+def _serve(size: int, port_queue: "multiprocessing.Queue[int]") -> None:
+    MockStorefrontHandler.catalog = build_catalog(size)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockStorefrontHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class MockStorefront:
+    """Runs the mock in a separate process so it does not compete with the client for the GIL."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def __enter__(self) -> str:
+        port_queue: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(self.size, port_queue), daemon=True)
+        self.process.start()
+        return f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    def __exit__(self, *_: Any) -> None:
+        self.process.terminate()
+        self.process.join()
+
+
+def run_once(engine: str, base_url: str, log_profile: str = "network") -> Dict[str, float]:
+    report = RunReport()
+    with report.span("client_startup"):
+        if engine == "selenium":
+            # The performance log is what is being measured, so do not let Fetch interception replace it.
+            client = AmulAPIClient(
+                PINCODE, base_url=base_url, block_resources=False, report=report, capture="log", log_profile=log_profile
+            )
+        else:
+            client = AmulHTTPClient(PINCODE, base_url=base_url, report=report)
+    try:
+        client.set_store_preferences()
+        products = client.get_products()
+    finally:
+        client.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = StockMonitor(
+            PINCODE, [], state_file=os.path.join(tmp, "stock_status.json"), fetch_mode=engine, report=report
+        )
+        monitor._fetch_products = lambda: products
+        try:
+            monitor.run_check()
+        finally:
+            monitor.close()
+
+    spans = report.spans
+    timings = {phase: spans.get(phase, 0.0) for phase in PHASES}
+    # The constructor also loads the home page in the browser; count all of it as startup.
+    timings["driver_startup"] = spans["client_startup"]
+    timings["page_load"] -= timings["log_parsing"]
+    for counter in TRANSFERS:
+        timings[counter] = report.counters.get(counter, 0)
+    return timings
+
+
+def run_benchmark(engine: str, sizes: List[int], repeat: int, log_profile: str = "network") -> Dict[int, Dict[str, float]]:
+    results: Dict[int, Dict[str, float]] = {}
+    for size in sizes:
+        with MockStorefront(size) as base_url:
+            runs = [run_once(engine, base_url, log_profile) for _ in range(repeat)]
+        results[size] = {key: statistics.median(r[key] for r in runs) for key in (*PHASES, *TRANSFERS)}
+        results[size]["total"] = sum(results[size][phase] for phase in PHASES)
+    return results
+
+
+def print_table(results: Dict[int, Dict[str, float]]) -> None:
+    columns = (*PHASES, "total")
+    print(f"{'products':>9} " + " ".join(f"{c:>17}" for c in columns))
+    for size, timings in results.items():
+        print(f"{size:>9} " + " ".join(f"{timings[c] * 1000:>15.1f}ms" for c in columns))
+
+
+def print_transfers(results: Dict[int, Dict[str, float]]) -> None:
+    print(f"{'products':>9} {'log events':>12} {'log kB':>10}")
+    for size, r in results.items():
+        print(f"{size:>9} {r['log_events_transferred']:>12.0f} {r['log_bytes_transferred'] / 1024:>10.1f}")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark a stock check against a local mock storefront")
+    parser.add_argument("--engine", choices=("http", "selenium"), default="http")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 1000, 50000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the median is reported")
+    parser.add_argument(
+        "--log-profile", choices=tuple(LOG_PROFILES), nargs="+", default=["network"],
+        help="performance log profile(s) to compare (selenium engine only)",
+    )
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    # Alerts for every product would otherwise flood the console on the first pass.
+    main.logger.setLevel(logging.WARNING)
+    if args.engine != "selenium":
+        results = run_benchmark(args.engine, args.sizes, args.repeat)
+        print_table(results)
+        output: Dict[str, Any] = {"engine": args.engine, "results": results}
+    else:
+        output = {"engine": args.engine, "log_profiles": {}}
+        for profile in args.log_profile:
+            results = run_benchmark(args.engine, args.sizes, args.repeat, profile)
+            print(f"\nlog profile: {profile}")
+            print_table(results)
+            print_transfers(results)
+            output["log_profiles"][profile] = results
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
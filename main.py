@@ -1,20 +1,59 @@
 
 from __future__ import annotations
 
+import argparse
+import base64
+import copy
+import functools
+import hashlib
 import json
 import logging
+import math
+import os
+import random
+import re
+import signal
+import sqlite3
+import struct
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Set, Tuple
+import unicodedata
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from fnmatch import fnmatch
+from fnmatch import translate as fnmatch_translate
+from typing import Any, BinaryIO, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, TypedDict, Union
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlunparse
 
 import requests  # For sending notifications
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
 
+# Optional faster JSON decoders for large ms.products pages; the stdlib json module is the fallback.
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# Selenium's CDP connection (used by the page agent) runs on trio.
+try:
+    import trio
+except ImportError:
+    trio = None
+
 # Basic logging setup
 logging.basicConfig(
     level=logging.INFO,
@@ -24,47 +63,579 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+BASE_URL = "https://shop.amul.com"
+PRODUCT_FIELDS = (
+    "name", "alias", "sku", "price", "available", "inventory_quantity", "categories",
+)
+
+
+class ProductSchemaError(ValueError):
+    """An ms.products record does not have the shape the monitor relies on."""
+
 
-@dataclass
 class Product:
-    alias: str
-    name: str
-    available: bool
-    url: str
-    price: float
-    inventory_quantity: int = 0
+    """One product from the ms.products API, validated and reduced to the fields the monitor uses."""
+
+    __slots__ = ("alias", "name", "key", "available", "price", "inventory_quantity", "category")
+
+    def __init__(
+        self,
+        alias: str,
+        name: str,
+        available: bool,
+        price: Optional[float],
+        inventory_quantity: int = 0,
+        category: Optional[str] = None,
+    ) -> None:
+        self.alias = alias
+        self.name = name
+        # Normalized name, used as the key in the stock status.
+        self.key = normalize_name(name)
+        self.available = available
+        self.price = price
+        self.inventory_quantity = inventory_quantity
+        self.category = category
+
+    @classmethod
+    def from_api(cls, record: Dict[str, Any], category: Optional[str] = None) -> "Product":
+        """Builds a Product from a raw API record, raising ProductSchemaError on schema drift."""
+        if not isinstance(record, dict):
+            raise ProductSchemaError(f"expected a product object, got {type(record).__name__}")
+        name = record.get("name")
+        alias = record.get("alias")
+        if not isinstance(name, str) or not name.strip():
+            raise ProductSchemaError(f"product {alias!r} has no name")
+        if not isinstance(alias, str) or not alias:
+            raise ProductSchemaError(f"product {name!r} has no alias")
+        if "available" not in record:
+            raise ProductSchemaError(f"product {alias!r} has no 'available' field")
+        available = record["available"]
+        if available not in (0, 1, True, False):
+            raise ProductSchemaError(f"product {alias!r} has unexpected 'available' value {available!r}")
+        # Price and inventory only go into the alert text, so a bad value must not drop the product.
+        price = _coerce_number(record.get("price"), float, alias, "price")
+        inventory = _coerce_number(record.get("inventory_quantity"), int, alias, "inventory_quantity") or 0
+        if category is None:
+            categories = record.get("categories")
+            category = categories[0] if isinstance(categories, list) and categories else None
+        return cls(alias, name, bool(available), price, inventory, category)
+
+    @property
+    def url(self) -> str:
+        return f"https://shop.amul.com/en/product/{self.alias}"
+
+    def __repr__(self) -> str:
+        return f"Product(alias={self.alias!r}, name={self.name!r}, available={self.available!r}, price={self.price!r})"
 
     def __str__(self) -> str:
         inventory_info = (
             f" (Stock: {self.inventory_quantity})" if self.inventory_quantity > 0 else ""
         )
         status = "Available" if self.available else "Unavailable"
-        return f"{self.name} ({status}){inventory_info} - ₹{self.price}"
+        return f"{self.name} ({status}){inventory_info} - {self.price_text}"
 
+    @property
+    def price_text(self) -> str:
+        return "price unknown" if self.price is None else f"₹{self.price}"
 
-def get_api_requests(
-    driver: webdriver.Chrome,
-    endpoint_filter: Optional[str] = None,
-) -> List[Tuple[str, str]]:
-    logs = driver.get_log("performance")
-    api_requests: List[Tuple[str, str]] = []
-    seen_urls: Set[str] = set()
-    for entry in logs:
+
+def _coerce_number(value: Any, kind: type, alias: str, field: str) -> Optional[Union[int, float]]:
+    """Converts a numeric API field, returning None with a warning if it is not a usable number."""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not math.isfinite(number) or (kind is int and not number.is_integer()):
+            raise ValueError
+        return kind(number)
+    except (TypeError, ValueError):
+        logger.warning("Product %s has an unusable %s %r; ignoring it.", alias, field, value)
+        return None
+
+
+def parse_products(records: List[Dict[str, Any]], category: Optional[str] = None) -> List[Product]:
+    """Validates raw ms.products records. Bad records are skipped with a warning.
+
+    Raises ProductSchemaError if none of a non-empty list parses, i.e. the schema changed.
+    """
+    products = []
+    errors = []
+    for record in records:
         try:
-            message = json.loads(entry["message"])
-            method = message["message"]["method"]
-            params = message["message"]["params"]
-            if method == "Network.responseReceived":
-                url = params["response"].get("url", "")
-                if url.startswith("https://shop.amul.com/api/"):
-                    if (
-                        endpoint_filter is None or endpoint_filter in url
-                    ) and url not in seen_urls:
-                        api_requests.append((params["requestId"], url))
-                        seen_urls.add(url)
-        except Exception:
+            products.append(Product.from_api(record, category))
+        except ProductSchemaError as e:
+            errors.append(str(e))
+    if errors:
+        if not products:
+            raise ProductSchemaError(f"no usable product in the API response ({errors[0]})")
+        logger.warning("Skipped %s malformed product(s), e.g. %s", len(errors), errors[0])
+    return products
+
+
+@dataclass
+class CheckSummary:
+    pincode: str
+    ok: bool = False
+    products_scanned: int = 0
+    in_stock: int = 0
+    alerts_sent: int = 0
+
+
+def normalize_name(name: str) -> str:
+    """Case-folds a product name and collapses whitespace, so cosmetic renames still match."""
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class ProductMatcher:
+    """Decides which products are monitored, compiled once from the TARGET_PRODUCTS rules.
+
+    Rules are plain names (matched after normalize_name) or prefixed with ``alias:``,
+    ``glob:``, ``re:`` or ``fuzzy:``. Names and aliases are dict lookups, all glob rules
+    are combined into one regex, and fuzzy rules go through an inverted token index, so
+    matching costs about the same however many of those there are. Regex rules are
+    compiled on their own (case-insensitively), so their flags, groups and backreferences
+    keep working. A fuzzy rule matches when at least fuzzy_threshold of its words appear.
+    """
+
+    def __init__(self, rules: List[str], fuzzy_threshold: float = 0.8) -> None:
+        self.rules = list(rules)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.names: Dict[str, str] = {}
+        self.aliases: Dict[str, str] = {}
+        globs: List[str] = []
+        self._glob_rules: List[str] = []
+        self._regexes: List[Tuple[re.Pattern, str]] = []
+        self._fuzzy_tokens: List[Set[str]] = []
+        self._fuzzy_rules: List[str] = []
+        self._token_index: Dict[str, List[int]] = {}
+
+        for rule in self.rules:
+            kind, _, value = rule.partition(":")
+            kind = kind.strip().lower()
+            value = value.strip()
+            if kind == "alias" and value:
+                self.aliases[value.lower()] = rule
+            elif kind == "glob" and value:
+                # Globs must match the whole name.
+                globs.append(rf"(?P<r{len(globs)}>\A{fnmatch_translate(normalize_name(value))})")
+                self._glob_rules.append(rule)
+            elif kind == "re" and value:
+                # Regexes may match anywhere in the normalized name.
+                try:
+                    self._regexes.append((re.compile(value, re.IGNORECASE), rule))
+                except re.error as e:
+                    raise ValueError(f"Invalid target product rule {rule!r}: {e}") from None
+            elif kind == "fuzzy" and value:
+                tokens = set(_TOKEN_RE.findall(normalize_name(value)))
+                for token in tokens:
+                    self._token_index.setdefault(token, []).append(len(self._fuzzy_rules))
+                self._fuzzy_tokens.append(tokens)
+                self._fuzzy_rules.append(rule)
+            else:
+                self.names[normalize_name(rule)] = rule
+        self._globs = re.compile("|".join(globs)) if globs else None
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def match(self, name: str, alias: Optional[str] = None) -> Optional[str]:
+        """Returns the rule that selects this product, or None. Everything matches an empty matcher."""
+        if not self.rules:
+            return ""
+        normalized = normalize_name(name)
+        rule = self.names.get(normalized)
+        if rule is None and alias:
+            rule = self.aliases.get(alias.lower())
+        if rule is None and self._globs is not None:
+            found = self._globs.match(normalized)
+            if found:
+                rule = self._glob_rules[int(found.lastgroup[1:])]
+        if rule is None:
+            rule = next((rule for regex, rule in self._regexes if regex.search(normalized)), None)
+        if rule is None and self._fuzzy_rules:
+            hits: Dict[int, int] = {}
+            for token in set(_TOKEN_RE.findall(normalized)):
+                for index in self._token_index.get(token, ()):
+                    hits[index] = hits.get(index, 0) + 1
+            for index, count in hits.items():
+                if count >= self.fuzzy_threshold * len(self._fuzzy_tokens[index]):
+                    rule = self._fuzzy_rules[index]
+                    break
+        return rule
+
+
+class RunReport:
+    """Per-phase timings and counters for one run, exportable as JSON or Prometheus text.
+
+    Spans with the same name accumulate, so a multi-pincode run reports the total time
+    spent in each phase. Spans may nest (page_load includes log_parsing).
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.spans: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "duration_seconds": round(time.time() - self.started_at, 6),
+                "spans": {name: round(seconds, 6) for name, seconds in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self) -> str:
+        report = self.to_dict()
+        lines = [
+            "# HELP amul_monitor_phase_seconds Wall time spent in each phase of the last run.",
+            "# TYPE amul_monitor_phase_seconds gauge",
+        ]
+        lines += [f'amul_monitor_phase_seconds{{phase="{name}"}} {value}' for name, value in report["spans"].items()]
+        lines += [
+            "# HELP amul_monitor_run_seconds Wall time of the last run.",
+            "# TYPE amul_monitor_run_seconds gauge",
+            f"amul_monitor_run_seconds {report['duration_seconds']}",
+            "# HELP amul_monitor_events Counters from the last run.",
+            "# TYPE amul_monitor_events gauge",
+        ]
+        lines += [f'amul_monitor_events{{name="{name}"}} {value}' for name, value in report["counters"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+        if json_path:
+            with open(json_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, "w") as f:
+                f.write(self.to_prometheus())
+
+
+def timed_phase(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Method decorator that records the call as a span on self.report."""
+
+    def decorator(method: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(method)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            with self.report.span(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def substore_from_url(url: str) -> Optional[str]:
+    """Extracts the substore query parameter from an ms.products URL."""
+    values = parse_qs(urlparse(url).query).get("substore")
+    return values[0] if values else None
+
+
+def process_tree_rss_mb(root_pid: int) -> float:
+    """Sums the resident set size of a process and all its descendants using /proc."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
             continue
-    return api_requests
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # The command name may contain spaces, so split after its closing parenthesis.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total_pages = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total_pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            pass
+        pending.extend(children.get(pid, []))
+    return total_pages * page_size / (1024 * 1024)
+
+
+def atomic_write(path: str, text: str) -> None:
+    """Writes text to path via a synced temp file and rename, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SessionCache:
+    """On-disk cache of the cookies and localStorage that pin a session to a pincode's store."""
+
+    def __init__(self, path: str = "session_cache.json", ttl: float = 6 * 3600) -> None:
+        self.path = path
+        self.ttl = ttl
+        # Shared by the worker threads of a multi-pincode run.
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self) -> None:
+        with self._lock:
+            atomic_write(self.path, json.dumps(self._entries))
+
+    def get(self, pincode: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached session for a pincode, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(pincode)
+            if entry is None:
+                return None
+            if time.time() - entry.get("saved_at", 0) > self.ttl:
+                logger.info("Cached session for pincode %s expired.", pincode)
+                self.invalidate(pincode)
+                return None
+            return entry
+
+    def put(
+        self,
+        pincode: str,
+        cookies: List[Dict[str, Any]],
+        local_storage: Optional[Dict[str, str]] = None,
+        store: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            self._entries[pincode] = {
+                "cookies": cookies,
+                "local_storage": local_storage or {},
+                "store": store,
+                "saved_at": time.time(),
+            }
+            self._save()
+
+    def set_store(self, pincode: str, store: str) -> None:
+        with self._lock:
+            entry = self._entries.get(pincode)
+            if entry is not None and entry.get("store") != store:
+                entry["store"] = store
+                self._save()
+
+    def invalidate(self, pincode: str) -> None:
+        with self._lock:
+            if self._entries.pop(pincode, None) is not None:
+                self._save()
+
+
+class StoreResolver:
+    """On-disk cache of the store that serves each pincode, so pincodes sharing a store are fetched once."""
+
+    def __init__(
+        self,
+        path: str = "store_cache.json",
+        ttl: float = 7 * 24 * 3600,
+        base_url: str = BASE_URL,
+        timeout: float = 10.0,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.base_url = base_url
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+        self._session: Optional[requests.Session] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self) -> None:
+        with self._lock:
+            atomic_write(self.path, json.dumps(self._entries))
+
+    def get(self, pincode: str) -> Optional[str]:
+        """Returns the cached store of a pincode, or None if unknown or expired."""
+        with self._lock:
+            entry = self._entries.get(pincode)
+            if entry is None or time.time() - entry.get("saved_at", 0) > self.ttl:
+                return None
+            return entry.get("store")
+
+    def put(self, pincode: str, store: str) -> None:
+        """Records the store a pincode was (observed to be) served by."""
+        with self._lock:
+            entry = self._entries.get(pincode)
+            # A confirmation only needs writing once the entry is halfway to expiring.
+            if entry and entry.get("store") == store and time.time() - entry.get("saved_at", 0) < self.ttl / 2:
+                return
+            self._entries[pincode] = {"store": store, "saved_at": time.time()}
+            self._save()
+
+    def resolve(self, pincode: str) -> Optional[str]:
+        """The store serving a pincode, looked up through the API on a cache miss. None if unknown."""
+        store = self.get(pincode)
+        if store:
+            return store
+        with self._lock:
+            if self._session is None:
+                self._session = api_session(self.base_url)
+        try:
+            store = lookup_substore(self._session, pincode, self.base_url, self.timeout)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Could not resolve the store for pincode %s: %s", pincode, e)
+            return None
+        if store:
+            self.put(pincode, store)
+        return store
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+
+
+API_URL_PREFIX = "https://shop.amul.com/api/"
+
+
+class PerformanceLogParser:
+    """Incrementally scans the CDP performance log for finished shop.amul.com API responses.
+
+    Raw message strings are pre-filtered with substring checks so only the few relevant
+    events are JSON-decoded. Scanning stops at the first match; unread entries are kept
+    for the next call because get_log drains chromedriver's buffer.
+    """
+
+    def __init__(
+        self,
+        driver: webdriver.Chrome,
+        api_prefix: str = API_URL_PREFIX,
+        report: Optional[RunReport] = None,
+    ) -> None:
+        self.driver = driver
+        self.api_prefix = api_prefix
+        self.report = report or RunReport()
+        self._backlog: Deque[str] = deque()
+        self._responses: Dict[str, str] = {}  # requestId -> url for API responses seen so far
+        self._finished: Set[str] = set()
+        self.scanned = 0
+        self.decoded = 0
+
+    def _read_log(self) -> List[str]:
+        """Drains chromedriver's buffer, counting what it had to transfer."""
+        messages = [entry["message"] for entry in self.driver.get_log("performance")]
+        self.report.incr("log_events_transferred", len(messages))
+        self.report.incr("log_bytes_transferred", sum(len(m) for m in messages))
+        return messages
+
+    def reset(self) -> None:
+        """Forgets every event seen so far, including ones still buffered by chromedriver."""
+        self.scanned += len(self._backlog) + len(self._read_log())
+        self._backlog.clear()
+        self._responses.clear()
+        self._finished.clear()
+
+    def _decode(self, raw: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        self.decoded += 1
+        try:
+            message = json.loads(raw)["message"]
+            return message["method"], message["params"]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _consume(self, raw: str) -> Optional[str]:
+        """Updates state from one raw event; returns a requestId if it just finished loading."""
+        if '"Network.responseReceived"' in raw:
+            if self.api_prefix not in raw:
+                return None
+            decoded = self._decode(raw)
+            if decoded and decoded[0] == "Network.responseReceived":
+                url = decoded[1]["response"].get("url", "")
+                if url.startswith(self.api_prefix):
+                    self._responses.setdefault(decoded[1]["requestId"], url)
+        elif '"Network.loadingFinished"' in raw:
+            if not any(f'"{request_id}"' in raw for request_id in self._responses):
+                return None
+            decoded = self._decode(raw)
+            if decoded and decoded[0] == "Network.loadingFinished":
+                request_id = decoded[1].get("requestId")
+                if request_id in self._responses:
+                    self._finished.add(request_id)
+                    return request_id
+        return None
+
+    def _match(self, url_predicate: Callable[[str], bool]) -> Optional[Tuple[str, str]]:
+        for request_id in self._finished:
+            url = self._responses[request_id]
+            if url_predicate(url):
+                return request_id, url
+        return None
+
+    @timed_phase("log_parsing")
+    def find_response(self, url_predicate: Callable[[str], bool]) -> Optional[Tuple[str, str]]:
+        """Scans buffered events until a matching API response has finished loading."""
+        match = self._match(url_predicate)
+        if match:
+            return match
+        self._backlog.extend(self._read_log())
+        while self._backlog:
+            raw = self._backlog.popleft()
+            self.scanned += 1
+            request_id = self._consume(raw)
+            if request_id and url_predicate(self._responses[request_id]):
+                return request_id, self._responses[request_id]
+        return None
+
+    def wait_for_response(
+        self,
+        url_predicate: Callable[[str], bool],
+        timeout: float = 15.0,
+        poll_interval: float = 0.05,
+    ) -> Optional[Tuple[str, str]]:
+        """Polls until a matching response has finished loading, or returns None at the deadline."""
+        deadline = time.monotonic() + timeout
+        scanned, decoded = self.scanned, self.decoded
+        while True:
+            match = self.find_response(url_predicate)
+            if match or time.monotonic() >= deadline:
+                logger.debug("Performance log: %s events scanned, %s decoded.", self.scanned, self.decoded)
+                self.report.incr("log_entries_scanned", self.scanned - scanned)
+                self.report.incr("log_entries_decoded", self.decoded - decoded)
+                return match
+            time.sleep(poll_interval)
 
 
 def get_response_body(
@@ -80,35 +651,818 @@ def get_response_body(
         return None
 
 
+def is_category_products_url(url: str, category: str) -> bool:
+    """True for the ms.products request that lists a category (as opposed to e.g. search)."""
+    parts = urlparse(url)
+    if not parts.path.endswith("ms.products"):
+        return False
+    query = parse_qs(parts.query)
+    return query.get("filters[0][field]") == ["categories"] and category in query.get("filters[0][value][0]", [])
+
+
+def with_query_params(url: str, **params: Any) -> str:
+    """Returns url with the given query parameters replaced."""
+    parts = urlparse(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in params]
+    query.extend((k, str(v)) for k, v in params.items())
+    return urlunparse(parts._replace(query=urlencode(query, safe="[]")))
+
+
+def remaining_page_starts(page: Dict[str, Any]) -> List[int]:
+    """Start offsets of the pages after this one, read from the response's paging block."""
+    paging = page.get("paging") or {}
+    limit = int(paging.get("limit") or len(page.get("data", [])))
+    start = int(paging.get("start") or 0)
+    total = int(paging.get("total") or 0)
+    if limit <= 0:
+        return []
+    return list(range(start + limit, total, limit))
+
+
+def products_params(category: str, substore: Optional[str], start: int = 0, limit: int = 32) -> Dict[str, Any]:
+    """Query parameters of the ms.products request that lists a category, as the storefront sends it."""
+    params: Dict[str, Any] = {f"fields[{field}]": 1 for field in PRODUCT_FIELDS}
+    params.update({
+        "filters[0][field]": "categories",
+        "filters[0][value][0]": category,
+        "filters[0][operator]": "in",
+        "limit": limit,
+        "start": start,
+        "total": 1,
+        "substore": substore,
+    })
+    return params
+
+
+def fetch_pages(
+    session: requests.Session,
+    first_url: str,
+    first_page: Dict[str, Any],
+    max_workers: int = 4,
+    timeout: float = 10.0,
+    cache: Optional[CatalogCache] = None,
+    cache_key: Optional[Tuple[str, str]] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Fetches the pages after first_page concurrently and returns every product in page order.
+
+    With a cache, pages are requested conditionally and the second value tells whether
+    all of them were unchanged since the last fetch; without one it is always False.
+    """
+
+    def fetch(start: int) -> Tuple[List[Dict[str, Any]], bool]:
+        url = with_query_params(first_url, start=start)
+        if cache is None:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            return decode_products_page(response.content)["data"], False
+        response = session.get(url, headers=cache.request_headers(cache_key, start), timeout=timeout)
+        page, unchanged = cache.decode_response(cache_key, start, response)
+        return page["data"], unchanged
+
+    products = list(first_page.get("data", []))
+    unchanged = cache is not None
+    starts = remaining_page_starts(first_page)
+    if starts:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            for page, page_unchanged in pool.map(fetch, starts):
+                products.extend(page)
+                unchanged = unchanged and page_unchanged
+    return products, unchanged
+
+
+# The only product fields Product.from_api reads; everything else in a record is dropped while decoding.
+DECODED_FIELDS = ("name", "alias", "available", "price", "inventory_quantity", "categories")
+
+
+class ProductRecord(TypedDict, total=False):
+    name: Any
+    alias: Any
+    available: Any
+    price: Any
+    inventory_quantity: Any
+    categories: Any
+
+
+if msgspec is not None:
+    JSON_DECODER = "msgspec"
+
+    class _ProductsPage(TypedDict, total=False):
+        # Records stay raw here so that an odd one is left to parse_products, as with the other decoders.
+        data: Optional[List[msgspec.Raw]]
+        paging: Any
+
+    # Decoding against the schema skips unknown keys without ever building objects for them.
+    _page_decoder = msgspec.json.Decoder(_ProductsPage)
+    _record_decoder = msgspec.json.Decoder(ProductRecord)
+    _any_decoder = msgspec.json.Decoder()
+elif orjson is not None:
+    JSON_DECODER = "orjson"
+else:
+    JSON_DECODER = "json"
+
+
+def _project_page(page: Any) -> Dict[str, Any]:
+    if not isinstance(page, dict):
+        raise ProductSchemaError(f"expected a products page object, got {type(page).__name__}")
+    data = page.get("data") or []
+    if not isinstance(data, list):
+        raise ProductSchemaError(f"expected 'data' to be a list, got {type(data).__name__}")
+    records = [
+        {field: record[field] for field in DECODED_FIELDS if field in record} if isinstance(record, dict) else record
+        for record in data
+    ]
+    return {"data": records, "paging": page.get("paging")}
+
+
+def _decode_record(raw: Any) -> Any:
+    try:
+        return _record_decoder.decode(raw)
+    except msgspec.ValidationError:
+        # Not an object: decoded as is, for parse_products to skip.
+        return _any_decoder.decode(raw)
+
+
+def decode_products_page(payload: Union[bytes, str]) -> Dict[str, Any]:
+    """Decodes an ms.products response, keeping only the paging block and DECODED_FIELDS of each product.
+
+    Uses msgspec or orjson when installed. Raises ValueError on malformed JSON and
+    ProductSchemaError when the page does not have the expected shape.
+    """
+    if JSON_DECODER == "msgspec":
+        try:
+            page = _page_decoder.decode(payload)
+        except msgspec.ValidationError as e:
+            raise ProductSchemaError(str(e)) from e
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+        return {"data": [_decode_record(raw) for raw in page.get("data") or []], "paging": page.get("paging")}
+    if JSON_DECODER == "orjson":
+        return _project_page(orjson.loads(payload))
+    return _project_page(json.loads(payload))
+
+
+def merge_products(product_lists: List[List[Product]]) -> List[Product]:
+    """Concatenates product lists, keeping the first occurrence of each alias."""
+    merged: Dict[str, Product] = {}
+    for products in product_lists:
+        for product in products:
+            merged.setdefault(product.alias, product)
+    return list(merged.values())
+
+
+class CachedPage(NamedTuple):
+    digest: bytes
+    page: Dict[str, Any]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class CatalogCache:
+    """The last products response per pincode and category, so an unchanged catalog is not decoded again.
+
+    A page counts as unchanged when the API answers 304 to its ETag/Last-Modified
+    validators, or otherwise when the raw body hashes the same as last time.
+    """
+
+    def __init__(self) -> None:
+        self._pages: Dict[Tuple[str, str, int], CachedPage] = {}
+        self._products: Dict[Tuple[str, str], List[Product]] = {}
+        self._lock = threading.Lock()
+
+    def request_headers(self, key: Tuple[str, str], start: int) -> Dict[str, str]:
+        """Conditional request headers for a page, if the API sent validators for it before."""
+        cached = self._pages.get((*key, start))
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def decode(
+        self,
+        key: Tuple[str, str],
+        start: int,
+        payload: Union[bytes, str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Returns the decoded page and whether it is the same as last time (in which case it is not decoded)."""
+        raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        cached = self._pages.get((*key, start))
+        if cached is not None and cached.digest == digest:
+            return cached.page, True
+        page = decode_products_page(raw)
+        with self._lock:
+            self._pages[(*key, start)] = CachedPage(digest, page, etag, last_modified)
+        return page, False
+
+    def decode_response(self, key: Tuple[str, str], start: int, response: requests.Response) -> Tuple[Dict[str, Any], bool]:
+        """Like decode, for a response to a request made with request_headers."""
+        if response.status_code == 304:
+            cached = self._pages.get((*key, start))
+            if cached is None:
+                raise ValueError(f"304 Not Modified for a page that was never fetched: {response.url}")
+            return cached.page, True
+        response.raise_for_status()
+        return self.decode(
+            key, start, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        )
+
+    def parse(
+        self,
+        key: Tuple[str, str],
+        records: List[Dict[str, Any]],
+        unchanged: bool,
+        category: Optional[str] = None,
+    ) -> Tuple[List[Product], bool]:
+        """Parses a category's records, reusing the products from last time if every page was unchanged."""
+        if unchanged:
+            cached = self._products.get(key)
+            if cached is not None:
+                return cached, True
+        products = parse_products(records, category)
+        with self._lock:
+            self._products[key] = products
+        return products, False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self._products.clear()
+
+
+# Everything the storefront loads that is not needed to render the pincode dialog and fire the API calls.
+DEFAULT_BLOCKED_URL_PATTERNS = (
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*connect.facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*clarity.ms*",
+)
+
+
+def blocked_url_patterns(
+    extra: Optional[List[str]] = None,
+    unblocked: Optional[List[str]] = None,
+) -> List[str]:
+    """Builds the Network.setBlockedURLs list: the defaults plus extra, minus the unblocked entries.
+
+    unblocked removes entries of that list by exact pattern; it is not an allow-list, so
+    anything not blocked still loads.
+    """
+    patterns = [*DEFAULT_BLOCKED_URL_PATTERNS, *(extra or [])]
+    unblocked_set = set(unblocked or [])
+    if unblocked_set.difference(patterns):
+        logger.warning(
+            "Unblocked URL patterns not on the block list: %s", ", ".join(sorted(unblocked_set.difference(patterns)))
+        )
+    patterns = [p for p in patterns if p not in unblocked_set]
+    # Never let a pattern take out the API calls we are here for.
+    return [p for p in patterns if not fnmatch(API_URL_PREFIX + "1/entity/ms.products", p)]
+
+
+# How the Selenium client reads API responses: CDP Fetch interception, or the performance log.
+CAPTURE_MODES = ("fetch", "log")
+
+# perfLoggingPrefs for the performance log. chromedriver filters by domain only: "network" keeps
+# the Network events the parser needs (responseReceived, loadingFinished) and drops Page events.
+LOG_PROFILES: Dict[str, Dict[str, Any]] = {
+    "full": {"enableNetwork": True, "enablePage": True},
+    "network": {"enableNetwork": True, "enablePage": False},
+}
+
+# Fetches the given URLs from the page, with the page's cookies, and hands back the raw bodies.
+IN_PAGE_FETCH_SCRIPT = """
+const urls = arguments[0], done = arguments[arguments.length - 1];
+Promise.all(urls.map(url => fetch(url, {credentials: "include", headers: {frontend: "1"}}).then(r => {
+    if (!r.ok) throw new Error("HTTP " + r.status + " for " + url);
+    return r.text();
+}))).then(bodies => done({bodies: bodies}), error => done({error: String(error)}));
+"""
+
+
+# Installs a poller in the storefront tab: it re-reads every page of the given categories on an
+# interval and reports only the products that changed, through the binding if there is one and
+# otherwise into a queue that AGENT_WAIT_SCRIPT long-polls. Returns whether the binding is used.
+PAGE_AGENT_SCRIPT = """
+const [urls, fields, intervalMs, bindingName] = arguments;
+if (window.__amulAgent) window.__amulAgent.stop();
+const useBinding = !!bindingName && typeof window[bindingName] === "function";
+const agent = window.__amulAgent = {queue: [], waiters: [], last: null, timer: null, failing: false};
+agent.stop = () => { clearTimeout(agent.timer); agent.stopped = true; agent.waiters.splice(0).forEach(w => w()); };
+const pick = r => Object.fromEntries(fields.filter(f => f in r).map(f => [f, r[f]]));
+const getJSON = async url => {
+    const r = await fetch(url, {credentials: "include", headers: {frontend: "1"}});
+    if (!r.ok) throw new Error("HTTP " + r.status + " for " + url);
+    return r.json();
+};
+const emit = event => {
+    const payload = JSON.stringify(event);
+    if (useBinding) return window[bindingName](payload);
+    agent.queue.push(payload);
+    agent.waiters.splice(0).forEach(w => w());
+};
+async function snapshot() {
+    const products = {};
+    for (const url of urls) {
+        const first = await getJSON(url);
+        const paging = first.paging || {}, limit = paging.limit || (first.data || []).length;
+        const starts = [];
+        for (let s = (paging.start || 0) + limit; limit > 0 && s < (paging.total || 0); s += limit) starts.push(s);
+        const rest = await Promise.all(starts.map(s => {
+            const u = new URL(url, location.href);
+            u.searchParams.set("start", s);
+            return getJSON(u.toString());
+        }));
+        for (const page of [first, ...rest])
+            for (const r of page.data || []) if (r && r.alias && !(r.alias in products)) products[r.alias] = pick(r);
+    }
+    return products;
+}
+async function tick() {
+    if (agent.stopped) return;
+    try {
+        const current = await snapshot();
+        const changed = Object.values(current).filter(
+            r => !agent.last || JSON.stringify(agent.last[r.alias]) !== JSON.stringify(r));
+        const removed = agent.last ? Object.keys(agent.last).filter(a => !(a in current)) : [];
+        if (!agent.last || changed.length || removed.length)
+            emit({full: !agent.last, changed: changed, removed: removed});
+        agent.last = current;
+        agent.failing = false;
+    } catch (e) {
+        if (!agent.failing) emit({error: String(e)});
+        agent.failing = true;
+    }
+    if (!agent.stopped) agent.timer = setTimeout(tick, intervalMs);
+}
+tick();
+return useBinding;
+"""
+
+AGENT_WAIT_SCRIPT = """
+const timeoutMs = arguments[0], done = arguments[arguments.length - 1], agent = window.__amulAgent;
+if (!agent || agent.stopped) return done(null);
+if (agent.queue.length) return done(agent.queue.splice(0));
+const timer = setTimeout(() => { agent.waiters = agent.waiters.filter(w => w !== wake); done([]); }, timeoutMs);
+const wake = () => { clearTimeout(timer); done(agent.stopped ? null : agent.queue.splice(0)); };
+agent.waiters.push(wake);
+"""
+
+
+class CDPListener(ABC):
+    """Works on a CDP session of its own from a background thread.
+
+    The session comes from driver.bidi_connection(), which runs on trio. Subclasses set the
+    session up in _setup, consume events in _listen and get _disconnected once it ends.
+    """
+
+    def __init__(self, driver: webdriver.Chrome, name: str) -> None:
+        self.driver = driver
+        # True once _setup has completed on a live connection.
+        self.connected = False
+        # Why the session ended or could not be opened.
+        self.error: Optional[Exception] = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._cancel: Any = None
+        self._trio_token: Any = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self) -> None:
+        if trio is None:
+            self.error = RuntimeError("trio is not installed")
+        else:
+            try:
+                trio.run(self._main)
+            except Exception as e:
+                self.error = e
+        self._disconnected(self.error)
+
+    async def _main(self) -> None:
+        with trio.CancelScope() as scope:
+            self._cancel = scope
+            self._trio_token = trio.lowlevel.current_trio_token()
+            async with self.driver.bidi_connection() as connection:
+                await self._setup(connection.session, connection.devtools)
+                self.connected = True
+                self._ready.set()
+                if not self._stop.is_set():
+                    await self._listen(connection.session, connection.devtools)
+
+    async def _setup(self, session: Any, devtools: Any) -> None:
+        pass
+
+    @abstractmethod
+    async def _listen(self, session: Any, devtools: Any) -> None:
+        """Consumes the session's events until it is closed."""
+
+    def _disconnected(self, error: Optional[Exception]) -> None:
+        """Called on the background thread when the session ended or could not be opened."""
+        self._ready.set()
+
+    def _close_session(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._cancel is not None:
+            try:
+                trio.from_thread.run_sync(self._cancel.cancel, trio_token=self._trio_token)
+            except (RuntimeError, trio.RunFinishedError):
+                pass
+        self._thread.join(timeout=timeout)
+
+
+class PageAgent(CDPListener):
+    """Keeps the product list current from a poller running inside the storefront tab.
+
+    The page only reports products that changed. Reports are pushed over a Runtime.addBinding
+    binding on a CDP session of our own when Selenium can open one, and otherwise long-polled
+    with execute_async_script. Either way a background thread applies them, so reading the
+    products costs no round trip to the browser.
+    """
+
+    BINDING = "__amulStockChanged"
+
+    def __init__(
+        self,
+        driver: webdriver.Chrome,
+        urls: List[str],
+        interval: float = 30.0,
+        on_change: Optional[Callable[[], None]] = None,
+        long_poll_timeout: float = 10.0,
+    ) -> None:
+        super().__init__(driver, name="page-agent")
+        self.urls = urls
+        self.interval = interval
+        self.on_change = on_change
+        self.long_poll_timeout = long_poll_timeout
+        self.transport: Optional[str] = None
+        # Bumped with every change applied; stays 0 until the first full list has arrived.
+        self.version = 0
+        self.healthy = True
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._installed = threading.Event()
+        self._first_snapshot = threading.Event()
+
+    def start(self) -> None:
+        self._thread.start()
+        # The binding has to exist before the agent looks for it.
+        if not self._ready.wait(timeout=30):
+            self.stop()
+            raise WebDriverException("page agent did not connect")
+        binding = self.BINDING if self.connected else None
+        installed = self.driver.execute_script(
+            PAGE_AGENT_SCRIPT, self.urls, list(DECODED_FIELDS), self.interval * 1000, binding
+        )
+        if binding and not installed:
+            self.stop()
+            raise WebDriverException("the CDP binding is not visible in the page")
+        self.transport = "binding" if installed else "long-poll"
+        self._installed.set()
+        logger.info("📡 Page agent polling every %ss, reporting changes by %s.", self.interval, self.transport)
+
+    async def _setup(self, session: Any, devtools: Any) -> None:
+        await session.execute(devtools.runtime.enable())
+        await session.execute(devtools.runtime.add_binding(name=self.BINDING))
+
+    async def _listen(self, session: Any, devtools: Any) -> None:
+        async for event in session.listen(devtools.runtime.BindingCalled, buffer_size=100):
+            if event.name == self.BINDING:
+                self._apply(event.payload)
+
+    def _disconnected(self, error: Optional[Exception]) -> None:
+        if self.connected:
+            if error is not None:
+                logger.warning("Page agent lost its CDP connection: %s", error)
+            self.healthy = self._stop.is_set()
+            self._first_snapshot.set()
+            return
+        logger.info("CDP binding unavailable (%s), long-polling the page agent instead.", error)
+        self._ready.set()
+        if not self._stop.is_set():
+            self._long_poll()
+
+    def _long_poll(self) -> None:
+        self._installed.wait()
+        while not self._stop.is_set():
+            try:
+                payloads = self.driver.execute_async_script(AGENT_WAIT_SCRIPT, self.long_poll_timeout * 1000)
+            except WebDriverException as e:
+                if not self._stop.is_set():
+                    logger.warning("Page agent long-poll failed: %s", e)
+                    self.healthy = False
+                break
+            if payloads is None:
+                # The page navigated away or the agent was stopped.
+                self.healthy = self._stop.is_set()
+                break
+            for payload in payloads:
+                self._apply(payload)
+        self._first_snapshot.set()
+
+    def _apply(self, payload: str) -> None:
+        event = json.loads(payload)
+        if "error" in event:
+            # The records it holds may be stale now, so the next check must fetch directly.
+            logger.warning("Page agent could not refresh the products: %s", event["error"])
+            self.healthy = False
+            self._first_snapshot.set()
+            return
+        with self._lock:
+            if event.get("full"):
+                self._records = {}
+            for record in event.get("changed", []):
+                self._records[record["alias"]] = record
+            for alias in event.get("removed", []):
+                self._records.pop(alias, None)
+            self.version += 1
+        self._first_snapshot.set()
+        if self.on_change is not None and self.version > 1:
+            self.on_change()
+
+    def snapshot(self, timeout: float = 15.0) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """The current product records and their version, or None if the agent has nothing usable."""
+        self._first_snapshot.wait(timeout)
+        if not self.healthy or not self.version:
+            return None
+        with self._lock:
+            return list(self._records.values()), self.version
+
+    def stop(self) -> None:
+        self._installed.set()
+        # A pending long-poll holds the WebDriver session, so let it return first.
+        self._close_session(timeout=self.long_poll_timeout + 5)
+        try:
+            self.driver.execute_script("window.__amulAgent && window.__amulAgent.stop();")
+        except WebDriverException:
+            pass
+
+
+class FetchCapture(CDPListener):
+    """Captures API response bodies as they arrive, with CDP Fetch interception.
+
+    Matching responses are paused at the response stage, their body is read and the response
+    released, all on a CDP session of our own. Unlike the performance log this needs no
+    Network.getResponseBody round trip that can find the body already evicted.
+
+    Interception is off until enable() is called, so only the requests of a navigation are
+    paused and the page's own fetch() calls and pollers are left alone.
+    """
+
+    def __init__(self, driver: webdriver.Chrome, url_pattern: str, max_responses: int = 64) -> None:
+        super().__init__(driver, name="fetch-capture")
+        self.url_pattern = url_pattern
+        self._responses: Deque[Tuple[str, str]] = deque(maxlen=max_responses)
+        self._arrived = threading.Condition()
+        self.intercepting = False
+        self._session: Any = None
+        self._devtools: Any = None
+
+    def start(self, timeout: float = 30.0) -> None:
+        self._thread.start()
+        self._ready.wait(timeout=timeout)
+        if not self.connected:
+            self.stop()
+            raise WebDriverException(f"Fetch interception is not available: {self.error}")
+
+    async def _setup(self, session: Any, devtools: Any) -> None:
+        self._session = session
+        self._devtools = devtools
+        # Also fails early if the Fetch domain is not available.
+        await session.execute(devtools.fetch.disable())
+
+    async def _intercept(self, enabled: bool) -> None:
+        fetch = self._devtools.fetch
+        if enabled:
+            pattern = fetch.RequestPattern(url_pattern=self.url_pattern, request_stage=fetch.RequestStage.RESPONSE)
+            await self._session.execute(fetch.enable(patterns=[pattern]))
+        else:
+            await self._session.execute(fetch.disable())
+
+    async def _listen(self, session: Any, devtools: Any) -> None:
+        async for event in session.listen(devtools.fetch.RequestPaused, buffer_size=100):
+            try:
+                if not event.response_error_reason and (event.response_status_code or 0) < 400:
+                    body, base64_encoded = await session.execute(devtools.fetch.get_response_body(event.request_id))
+                    if base64_encoded:
+                        body = base64.b64decode(body).decode("utf-8")
+                    with self._arrived:
+                        self._responses.append((event.request.url, body))
+                        self._arrived.notify_all()
+            except Exception as e:
+                logger.debug("Could not capture %s: %s", event.request.url, e)
+            finally:
+                # The page waits for this response until it is released.
+                await session.execute(devtools.fetch.continue_request(event.request_id))
+
+    def _disconnected(self, error: Optional[Exception]) -> None:
+        if self.connected and error is not None:
+            logger.warning("Fetch interception stopped: %s", error)
+        self.connected = False
+        with self._arrived:
+            self._arrived.notify_all()
+        self._ready.set()
+
+    def _set_intercepting(self, enabled: bool) -> None:
+        if not self.connected or self.intercepting == enabled:
+            return
+        try:
+            trio.from_thread.run(self._intercept, enabled, trio_token=self._trio_token)
+        except Exception as e:
+            logger.debug("Could not %s Fetch interception: %s", "enable" if enabled else "disable", e)
+            return
+        self.intercepting = enabled
+
+    @contextmanager
+    def enabled(self) -> Iterator[None]:
+        """Intercepts matching responses inside the block, e.g. around a navigation."""
+        self._set_intercepting(True)
+        try:
+            yield
+        finally:
+            self._set_intercepting(False)
+
+    def reset(self) -> None:
+        """Forgets captured responses, e.g. before navigating."""
+        with self._arrived:
+            self._responses.clear()
+
+    def wait_for_response(self, url_predicate: Callable[[str], bool], timeout: float = 15.0) -> Optional[Tuple[str, str]]:
+        """Waits for a captured response whose URL matches, returning (url, body), or None on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._arrived:
+            while True:
+                for i, (url, body) in enumerate(self._responses):
+                    if url_predicate(url):
+                        del self._responses[i]
+                        return url, body
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.connected:
+                    return None
+                self._arrived.wait(remaining)
+
+    def stop(self) -> None:
+        self._close_session()
+
+
 class AmulAPIClient:
-    def __init__(self, pincode: str) -> None:
+    def __init__(
+        self,
+        pincode: str,
+        session_cache: Optional[SessionCache] = None,
+        response_timeout: float = 15.0,
+        block_resources: bool = True,
+        blocked_patterns: Optional[List[str]] = None,
+        categories: Optional[List[str]] = None,
+        page_concurrency: int = 4,
+        base_url: str = BASE_URL,
+        report: Optional[RunReport] = None,
+        catalog_cache: Optional[CatalogCache] = None,
+        in_page_fetch: bool = True,
+        agent_interval: float = 0.0,
+        capture: str = "fetch",
+        log_profile: str = "network",
+    ) -> None:
+        if capture not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode {capture!r}, expected one of {', '.join(CAPTURE_MODES)}")
+        if log_profile not in LOG_PROFILES:
+            raise ValueError(f"Unknown log profile {log_profile!r}, expected one of {', '.join(LOG_PROFILES)}")
         self.pincode = pincode
+        self.base_url = base_url.rstrip("/")
+        self._report = report or RunReport()
+        # Once the store is known, call the API from the page instead of navigating to each category.
+        self.in_page_fetch = in_page_fetch
+        # Seconds between refreshes by a poller left running in the page (0 disables it).
+        self.agent_interval = agent_interval
+        self.agent: Optional[PageAgent] = None
+        self._agent_version = 0
+        self._agent_products: List[Product] = []
+        # Set whenever the page agent reports a change, e.g. to wake up the daemon.
+        self.change_event: Optional[threading.Event] = None
+        self.categories = categories or ["protein"]
+        self.page_concurrency = page_concurrency
+        self.session_cache = session_cache
+        self.catalog_cache = catalog_cache or CatalogCache()
+        # Whether the last get_products returned exactly the catalog of the one before.
+        self.catalog_unchanged = False
+        self.response_timeout = response_timeout
+        self.block_resources = block_resources
+        self.blocked_patterns = blocked_url_patterns() if blocked_patterns is None else blocked_patterns
+        self.store_selected = False
+        # The store the last products response was served for.
+        self.substore: Optional[str] = None
+        self.capture_mode = capture
+        self.log_profile = log_profile
+        # Set by _create_driver when Fetch interception is running; the performance log is off then.
+        self.capture: Optional[FetchCapture] = None
+        self.log_parser: Optional[PerformanceLogParser] = None
         self.driver = self._create_driver()
         self.wait = WebDriverWait(self.driver, 10)
-        self.driver.get("https://shop.amul.com/en/")
-        time.sleep(0.5)
+        if self.capture is None:
+            self.log_parser = PerformanceLogParser(self.driver, api_prefix=f"{self.base_url}/api/", report=self.report)
+        # driver.get returns after the load event; set_store_preferences waits for its own elements.
+        self.driver.get(f"{self.base_url}/en/")
 
+    @property
+    def report(self) -> RunReport:
+        return self._report
+
+    @report.setter
+    def report(self, report: RunReport) -> None:
+        self._report = report
+        if getattr(self, "log_parser", None) is not None:
+            self.log_parser.report = report
+
+    @timed_phase("driver_startup")
     def _create_driver(self) -> webdriver.Chrome:
+        if self.capture_mode == "fetch":
+            driver = self._launch_chrome(performance_log=False)
+            capture = FetchCapture(driver, f"{self.base_url}/api/1/entity/ms.products*")
+            try:
+                capture.start()
+            except WebDriverException as e:
+                logger.warning("Fetch interception unavailable (%s). Using the performance log instead.", e)
+                driver.quit()
+            else:
+                self.capture = capture
+                return driver
+        return self._launch_chrome(performance_log=True)
+
+    def _launch_chrome(self, performance_log: bool) -> webdriver.Chrome:
         chrome_options = Options()
         chrome_options.add_argument("--headless")
         chrome_options.add_argument("--disable-gpu")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-        
+        if performance_log:
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+            chrome_options.add_experimental_option("perfLoggingPrefs", LOG_PROFILES[self.log_profile])
+        if self.block_resources:
+            chrome_options.add_experimental_option(
+                "prefs", {"profile.managed_default_content_settings.images": 2}
+            )
+
         # When run in GitHub Actions, Selenium Manager will automatically
         # download and manage the correct chromedriver.
         driver = webdriver.Chrome(options=chrome_options)
         driver.execute_cdp_cmd("Network.enable", {})
+        if self.block_resources and self.blocked_patterns:
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_patterns})
         return driver
 
-    def __del__(self) -> None:
+    def memory_mb(self) -> Optional[float]:
+        """Resident memory of chromedriver and every Chrome process below it (Linux only)."""
         try:
+            return process_tree_rss_mb(self.driver.service.process.pid)
+        except (AttributeError, OSError):
+            return None
+
+    def close(self) -> None:
+        try:
+            self._stop_agent()
+            if self.capture is not None:
+                self.capture.stop()
             self.driver.quit()
         except Exception:
             pass
+
+    def __del__(self) -> None:
+        self.close()
             
+    def _restore_session(self) -> bool:
+        """Injects a cached store session into the browser instead of typing the pincode."""
+        entry = self.session_cache.get(self.pincode) if self.session_cache else None
+        if not entry:
+            return False
+        try:
+            for cookie in entry["cookies"]:
+                self.driver.add_cookie(cookie)
+            self.driver.execute_script(
+                "for (const [k, v] of Object.entries(arguments[0])) { window.localStorage.setItem(k, v); }",
+                entry["local_storage"],
+            )
+        except Exception as e:
+            logger.warning("Could not restore cached session: %s", e)
+            self.session_cache.invalidate(self.pincode)
+            return False
+        # get_products navigates afterwards, which makes the storefront pick up the injected state.
+        logger.info("✅ Reused cached session for pincode %s", self.pincode)
+        self.store_selected = True
+        return True
+
+    def _store_session(self) -> None:
+        if not self.session_cache:
+            return
+        local_storage = self.driver.execute_script("return Object.assign({}, window.localStorage);")
+        self.session_cache.put(self.pincode, self.driver.get_cookies(), local_storage)
+
+    @timed_phase("pincode_selection")
     def set_store_preferences(self) -> bool:
+        if self._restore_session():
+            return True
         input_box = self.wait.until(
             ec.visibility_of_element_located((By.CSS_SELECTOR, 'input[placeholder="Enter Your Pincode"]'))
         )
@@ -124,160 +1478,1759 @@ class AmulAPIClient:
             ec.visibility_of_element_located((By.CSS_SELECTOR, "div.pincode_wrap span.ms-2.fw-semibold"))
         )
         logger.info("✅ Pin code confirmed: %s", confirmation.text)
+        self._store_session()
+        self.store_selected = True
         return True
 
-    def get_products(self) -> List[Dict[str, Any]]:
-        protein_url = "https://shop.amul.com/en/browse/protein"
-        self.driver.get(protein_url)
-        time.sleep(2)
-        api_requests = get_api_requests(self.driver, endpoint_filter="ms.products")
-        for request_id, url in api_requests:
-            if 'filters[0][field]=categories' in url:
-                body = get_response_body(self.driver, request_id)
-                if body and "body" in body:
-                    json_data = json.loads(body["body"])
-                    product_list = json_data.get("data", [])
-                    logger.info("Found %s protein products.", len(product_list))
-                    return product_list
-        logger.error("Could not find products data.")
-        return []
+    def _check_store(self, url: str) -> bool:
+        """Records the store a response was served for; False if it contradicts the cached one."""
+        store = substore_from_url(url)
+        self.substore = store or self.substore
+        if not self.session_cache:
+            return True
+        entry = self.session_cache.get(self.pincode)
+        if not store or not entry:
+            return True
+        if entry.get("store") and entry["store"] != store:
+            logger.warning(
+                "Cached session for pincode %s returned store %s instead of %s. Invalidating it.",
+                self.pincode, store, entry["store"],
+            )
+            self.session_cache.invalidate(self.pincode)
+            self.store_selected = False
+            self.substore = None
+            return False
+        self.session_cache.set_store(self.pincode, store)
+        return True
+
+    def _reset_session(self) -> None:
+        """Clears a restored session that belongs to another store, so the pincode can be entered again."""
+        self._stop_agent()
+        self.driver.delete_all_cookies()
+        self.driver.execute_script("window.localStorage.clear();")
+        self.driver.get(f"{self.base_url}/en/")
+
+    def _page_session(self) -> requests.Session:
+        """An API session sharing the browser's cookies and user agent, used to fetch further pages."""
+        session = api_session(self.base_url)
+        session.headers["User-Agent"] = self.driver.execute_script("return navigator.userAgent;")
+        for cookie in self.driver.get_cookies():
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""))
+        return session
+
+    def _discard_captured(self) -> None:
+        """Drops API responses captured so far, so only the next page's response can match."""
+        if self.capture is not None:
+            self.capture.reset()
+        else:
+            self.log_parser.reset()
+
+    def _wait_for_products_body(self, category: str) -> Optional[Tuple[str, Optional[str]]]:
+        """The URL and body of the category's ms.products response; None if it never came."""
+        predicate = lambda url: is_category_products_url(url, category)  # noqa: E731
+        if self.capture is not None:
+            return self.capture.wait_for_response(predicate, timeout=self.response_timeout)
+        match = self.log_parser.wait_for_response(predicate, timeout=self.response_timeout)
+        if not match:
+            return None
+        request_id, url = match
+        body = get_response_body(self.driver, request_id)
+        return url, body.get("body") if body else None
+
+    def _fetch_category(self, category: str, session: requests.Session) -> Optional[Tuple[List[Product], bool]]:
+        self._discard_captured()
+        with self.capture.enabled() if self.capture is not None else nullcontext():
+            self.driver.get(f"{self.base_url}/en/browse/{category}")
+            response = self._wait_for_products_body(category)
+        if not response:
+            logger.error("Could not find products data for %s.", category)
+            return [], False
+        url, body = response
+        if not self._check_store(url):
+            return None
+        if body is None:
+            logger.error("Could not read products data for %s.", category)
+            return [], False
+        key = (self.pincode, category)
+        first_page, first_unchanged = self.catalog_cache.decode(key, 0, body)
+        records, rest_unchanged = fetch_pages(
+            session, url, first_page, self.page_concurrency, cache=self.catalog_cache, cache_key=key
+        )
+        return self.catalog_cache.parse(key, records, first_unchanged and rest_unchanged, category)
+
+    def _fetch_in_page(self, urls: List[str]) -> List[str]:
+        result = self.driver.execute_async_script(IN_PAGE_FETCH_SCRIPT, urls)
+        if not result or "error" in result:
+            raise ValueError((result or {}).get("error", "no result"))
+        return result["bodies"]
+
+    def _fetch_category_in_page(self, category: str) -> Optional[Tuple[List[Product], bool]]:
+        """Fetches a category with fetch() from the current page. None if that did not work."""
+        key = (self.pincode, category)
+        url = f"{self.base_url}/api/1/entity/ms.products"
+        first_url = with_query_params(url, **products_params(category, self.substore))
+        try:
+            first_page, unchanged = self.catalog_cache.decode(key, 0, self._fetch_in_page([first_url])[0])
+            starts = remaining_page_starts(first_page)
+            records = list(first_page.get("data", []))
+            bodies = self._fetch_in_page([with_query_params(first_url, start=start) for start in starts])
+            for start, body in zip(starts, bodies):
+                page, page_unchanged = self.catalog_cache.decode(key, start, body)
+                records.extend(page.get("data", []))
+                unchanged = unchanged and page_unchanged
+        except (WebDriverException, ValueError) as e:
+            logger.warning("In-page fetch of %s failed, loading the page instead: %s", category, e)
+            return None
+        finally:
+            # Fetch interception is off here, but the performance log still sees these requests.
+            self._discard_captured()
+        return self.catalog_cache.parse(key, records, unchanged, category)
+
+    def _start_agent(self) -> None:
+        url = f"{self.base_url}/api/1/entity/ms.products"
+        urls = [with_query_params(url, **products_params(category, self.substore)) for category in self.categories]
+        agent = PageAgent(self.driver, urls, self.agent_interval, on_change=self._agent_changed)
+        try:
+            agent.start()
+        except WebDriverException as e:
+            logger.warning("Could not start the page agent: %s", e)
+            return
+        self.agent = agent
+
+    def _stop_agent(self) -> None:
+        if self.agent is not None:
+            self.agent.stop()
+            self.agent = None
+
+    def _agent_changed(self) -> None:
+        if self.change_event is not None:
+            self.change_event.set()
+
+    def _products_from_agent(self) -> Optional[List[Product]]:
+        """The latest products reported by the page agent, or None if it stopped working."""
+        snapshot = self.agent.snapshot(timeout=self.response_timeout)
+        if snapshot is None:
+            logger.warning("Page agent stopped reporting or failed to refresh. Fetching the products directly.")
+            self._stop_agent()
+            return None
+        records, version = snapshot
+        if version == self._agent_version:
+            self.catalog_unchanged = True
+            return self._agent_products
+        self._agent_products = merge_products([parse_products(records)])
+        self._agent_version = version
+        return self._agent_products
+
+    @timed_phase("page_load")
+    def get_products(self) -> List[Product]:
+        self.catalog_unchanged = False
+        if self.agent is not None:
+            products = self._products_from_agent()
+            if products is not None:
+                logger.info("Found %s products in %s (page agent).", len(products), ", ".join(self.categories))
+                return products
+        self.driver.set_script_timeout(self.response_timeout)
+        session: Optional[requests.Session] = None
+        product_lists = []
+        unchanged = True
+        try:
+            for category in self.categories:
+                result = None
+                # The first check navigates, which also tells us the store and validates a restored session.
+                if self.in_page_fetch and self.substore:
+                    result = self._fetch_category_in_page(category)
+                if result is None:
+                    session = session or self._page_session()
+                    result = self._fetch_category(category, session)
+                if result is None:
+                    # The restored session was for another store: select the right one and start over.
+                    self._reset_session()
+                    if not self.set_store_preferences():
+                        return []
+                    return self.get_products()
+                product_lists.append(result[0])
+                unchanged = unchanged and result[1]
+        finally:
+            if session is not None:
+                session.close()
+        self.catalog_unchanged = unchanged
+        product_list = merge_products(product_lists)
+        logger.info("Found %s products in %s.", len(product_list), ", ".join(self.categories))
+        if self.agent_interval and self.agent is None and self.substore:
+            self._start_agent()
+        return product_list
+
+
+def api_session(base_url: str = BASE_URL) -> requests.Session:
+    """A requests session with the headers the storefront's own API calls carry."""
+    base_url = base_url.rstrip("/")
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": (
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+        ),
+        "Accept": "application/json, text/plain, */*",
+        "Origin": base_url,
+        "Referer": f"{base_url}/en/",
+        "frontend": "1",
+    })
+    return session
+
+
+def lookup_substore(
+    session: requests.Session,
+    pincode: str,
+    base_url: str = BASE_URL,
+    timeout: float = 10.0,
+) -> Optional[str]:
+    """Looks up the substore that serves a pincode."""
+    response = session.get(f"{base_url.rstrip('/')}/entity/pincode", params={
+        "limit": 50,
+        "filters[0][field]": "pincode",
+        "filters[0][value]": pincode,
+        "filters[0][operator]": "regex",
+        "cf_cache": "1h",
+    }, timeout=timeout)
+    response.raise_for_status()
+    for record in response.json().get("records", []):
+        if str(record.get("pincode")) == str(pincode) and record.get("substore"):
+            return record["substore"]
+    return None
+
+
+class AmulHTTPClient:
+    """Talks to the shop.amul.com JSON API directly, without a browser."""
+
+    def __init__(
+        self,
+        pincode: str,
+        base_url: str = BASE_URL,
+        timeout: float = 10.0,
+        session_cache: Optional[SessionCache] = None,
+        categories: Optional[List[str]] = None,
+        page_concurrency: int = 4,
+        report: Optional[RunReport] = None,
+        catalog_cache: Optional[CatalogCache] = None,
+    ) -> None:
+        self.pincode = pincode
+        self.categories = categories or ["protein"]
+        self.page_concurrency = page_concurrency
+        self.report = report or RunReport()
+        self.session_cache = session_cache
+        self.catalog_cache = catalog_cache or CatalogCache()
+        # Whether the last get_products returned exactly the catalog of the one before.
+        self.catalog_unchanged = False
+        self._from_cache = False
+        self.store_selected = False
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.substore: Optional[str] = None
+        self.session = api_session(self.base_url)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def resolve_substore(self) -> Optional[str]:
+        """Looks up the substore that serves this pincode."""
+        return lookup_substore(self.session, self.pincode, self.base_url, self.timeout)
+
+    def _restore_session(self) -> bool:
+        entry = self.session_cache.get(self.pincode) if self.session_cache else None
+        if not entry or not entry.get("store"):
+            return False
+        for cookie in entry["cookies"]:
+            self.session.cookies.set(
+                cookie["name"], cookie["value"], domain=cookie.get("domain", ""), path=cookie.get("path", "/")
+            )
+        self.substore = entry["store"]
+        self._from_cache = True
+        self.store_selected = True
+        logger.info("✅ Reused cached session for pincode %s (store %s)", self.pincode, self.substore)
+        return True
+
+    def _store_session(self) -> None:
+        if not self.session_cache:
+            return
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in self.session.cookies
+        ]
+        self.session_cache.put(self.pincode, cookies, store=self.substore)
+
+    def _reset_session(self) -> None:
+        """Drops a cached session that the API no longer accepts."""
+        logger.warning("Cached session for pincode %s was rejected. Re-selecting the store.", self.pincode)
+        self.session_cache.invalidate(self.pincode)
+        self.session.cookies.clear()
+        self._from_cache = False
+        self.store_selected = False
+
+    @timed_phase("pincode_selection")
+    def set_store_preferences(self) -> bool:
+        if self._restore_session():
+            return True
+        # Visiting the storefront and info.js hands out the session cookies the API expects.
+        self.session.get(f"{self.base_url}/en/", timeout=self.timeout).raise_for_status()
+        self.session.get(
+            f"{self.base_url}/user/info.js", params={"_v": int(time.time() * 1000)}, timeout=self.timeout
+        ).raise_for_status()
+        self.substore = self.resolve_substore()
+        if not self.substore:
+            logger.error("No store found for pincode %s", self.pincode)
+            return False
+        response = self.session.put(
+            f"{self.base_url}/entity/ms.settings/_/setPreferences",
+            json={"data": {"store": self.substore}},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        logger.info("✅ Pin code confirmed: %s (store %s)", self.pincode, self.substore)
+        self._store_session()
+        self.store_selected = True
+        return True
+
+    def _fetch_category(self, category: str) -> Tuple[List[Product], bool]:
+        key = (self.pincode, category)
+        response = self.session.get(
+            f"{self.base_url}/api/1/entity/ms.products",
+            params=products_params(category, self.substore),
+            headers=self.catalog_cache.request_headers(key, 0),
+            timeout=self.timeout,
+        )
+        first_page, first_unchanged = self.catalog_cache.decode_response(key, 0, response)
+        records, rest_unchanged = fetch_pages(
+            self.session, response.url, first_page, self.page_concurrency, self.timeout, self.catalog_cache, key
+        )
+        return self.catalog_cache.parse(key, records, first_unchanged and rest_unchanged, category)
+
+    @timed_phase("page_load")
+    def get_products(self) -> List[Product]:
+        self.catalog_unchanged = False
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.categories)) as pool:
+                results = list(pool.map(self._fetch_category, self.categories))
+        except requests.HTTPError:
+            if not self._from_cache:
+                raise
+            results = []
+        product_lists = [products for products, _ in results]
+        if self._from_cache and not any(product_lists):
+            self._reset_session()
+            if not self.set_store_preferences():
+                return []
+            return self.get_products()
+        self.catalog_unchanged = bool(results) and all(unchanged for _, unchanged in results)
+        product_list = merge_products(product_lists)
+        logger.info("Found %s products in %s.", len(product_list), ", ".join(self.categories))
+        return product_list
+
+
+# Price and inventory of a product as last observed, stored next to its availability where supported.
+ProductDetails = Dict[str, Tuple[Optional[float], Optional[int]]]
+
+
+class StateStore(ABC):
+    """Where the last known availability of each product is kept, per pincode."""
+
+    @abstractmethod
+    def load(self, pincode: str) -> Dict[str, bool]:
+        """The saved status of a pincode's products; empty if there is none."""
+
+    @abstractmethod
+    def save(
+        self,
+        states: Dict[str, Dict[str, bool]],
+        details: Optional[Dict[str, ProductDetails]] = None,
+    ) -> None:
+        """Persists the status of every given pincode; details are keyed the same way."""
+
+    def close(self) -> None:
+        pass
+
+
+class JSONStateStore(StateStore):
+    """The stock_status.json file read by the configuration UI.
+
+    A single pincode is stored as a flat {product: bool} map, several pincodes as
+    {pincode: {product: bool}}. A flat file applies to every pincode when loaded.
+    """
+
+    def __init__(self, path: str = 'stock_status.json') -> None:
+        self.path = path
+        self._state: Optional[Dict[str, Any]] = None
+
+    def _read(self) -> Dict[str, Any]:
+        if self._state is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self._state = json.load(f)
+                logger.info("Loaded previous stock status from %s", self.path)
+            except (FileNotFoundError, json.JSONDecodeError):
+                logger.warning("Could not load previous state. Starting fresh.")
+                self._state = {}
+        return self._state
+
+    def load(self, pincode: str) -> Dict[str, bool]:
+        state = self._read()
+        if any(isinstance(v, dict) for v in state.values()):
+            return dict(state.get(pincode, {}))
+        return dict(state)
+
+    def save(
+        self,
+        states: Dict[str, Dict[str, bool]],
+        details: Optional[Dict[str, ProductDetails]] = None,
+    ) -> None:
+        state: Dict[str, Any] = next(iter(states.values())) if len(states) == 1 else states
+        if state == self._read():
+            logger.info("Stock status unchanged, not rewriting %s", self.path)
+            return
+        atomic_write(self.path, json.dumps(state, indent=2))
+        self._state = copy.deepcopy(state)
+        logger.info("Saved current stock status to %s", self.path)
+
+
+class SQLiteStateStore(StateStore):
+    """One row per pincode and product in a WAL-mode SQLite database; only changed rows are written."""
+
+    def __init__(self, path: str = 'stock_status.db') -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stock_status (
+                pincode TEXT NOT NULL,
+                product TEXT NOT NULL,
+                available INTEGER NOT NULL,
+                price REAL,
+                inventory_quantity INTEGER,
+                last_changed REAL NOT NULL,
+                PRIMARY KEY (pincode, product)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+        # Last persisted (available, price, inventory) per (pincode, product).
+        self._rows: Dict[Tuple[str, str], Tuple[bool, Optional[float], Optional[int]]] = {}
+
+    def load(self, pincode: str) -> Dict[str, bool]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT product, available, price, inventory_quantity FROM stock_status WHERE pincode = ?",
+                (pincode,),
+            ).fetchall()
+        status = {}
+        for product, available, price, inventory in rows:
+            self._rows[(pincode, product)] = (bool(available), price, inventory)
+            status[product] = bool(available)
+        logger.info("Loaded previous stock status for %s from %s", pincode, self.path)
+        return status
+
+    def save(
+        self,
+        states: Dict[str, Dict[str, bool]],
+        details: Optional[Dict[str, ProductDetails]] = None,
+    ) -> None:
+        now = time.time()
+        changed = []
+        for pincode, status in states.items():
+            pincode_details = (details or {}).get(pincode, {})
+            for product, available in status.items():
+                previous = self._rows.get((pincode, product))
+                price, inventory = pincode_details.get(product, previous[1:] if previous else (None, None))
+                row = (bool(available), price, inventory)
+                if row != previous:
+                    changed.append((pincode, product, int(available), price, inventory, now))
+                    self._rows[(pincode, product)] = row
+        if not changed:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO stock_status (pincode, product, available, price, inventory_quantity, last_changed)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (pincode, product) DO UPDATE SET
+                    last_changed = CASE WHEN available != excluded.available
+                                        THEN excluded.last_changed ELSE last_changed END,
+                    available = excluded.available,
+                    price = excluded.price,
+                    inventory_quantity = excluded.inventory_quantity
+                """,
+                changed,
+            )
+        logger.info("Saved %s changed product(s) to %s", len(changed), self.path)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+STATE_BACKENDS = {"json": JSONStateStore, "sqlite": SQLiteStateStore}
+
+
+@dataclass
+class Alert:
+    title: str
+    message: str
+    click: Optional[str] = None
+    tags: str = "tada,shopping_cart"
+
+
+class AlertOutbox:
+    """Durable record of alerts that have not been delivered yet, kept as an append-only JSON-lines log.
+
+    Failed deliveries are retried with exponential backoff; an alert is only removed
+    after ntfy.sh answered with a 2xx. Alerts older than max_age are dropped as stale.
+    """
+
+    def __init__(
+        self,
+        path: str = "alert_outbox.jsonl",
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        max_age: float = 24 * 3600,
+    ) -> None:
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._in_flight: Set[str] = set()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A torn last line from a crash mid-append.
+                    op, entry_id = record.get("op"), record.get("id")
+                    if op == "add":
+                        self._entries[entry_id] = {
+                            "alert": record["alert"],
+                            "created_at": record["created_at"],
+                            "attempts": 0,
+                            "next_attempt_at": 0.0,
+                        }
+                    elif op == "fail" and entry_id in self._entries:
+                        self._entries[entry_id]["attempts"] = record["attempts"]
+                        self._entries[entry_id]["next_attempt_at"] = record["next_attempt_at"]
+                    elif op == "done":
+                        self._entries.pop(entry_id, None)
+        except FileNotFoundError:
+            return
+        # Only rewrite the file if it holds delivered, dropped, superseded or torn records.
+        if lines > sum(2 if entry["attempts"] else 1 for entry in self._entries.values()):
+            self._compact()
+        if self._entries:
+            logger.info("%s undelivered alert(s) waiting in %s", len(self._entries), self.path)
+
+    def _compact(self) -> None:
+        """Rewrites the log with only the pending alerts."""
+        lines = []
+        for entry_id, entry in self._entries.items():
+            lines.append(json.dumps({"op": "add", "id": entry_id, "alert": entry["alert"], "created_at": entry["created_at"]}))
+            if entry["attempts"]:
+                lines.append(json.dumps({
+                    "op": "fail", "id": entry_id,
+                    "attempts": entry["attempts"], "next_attempt_at": entry["next_attempt_at"],
+                }))
+        atomic_write(self.path, "".join(line + "\n" for line in lines))
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, alert: Alert) -> str:
+        """Records a new alert; the caller is expected to attempt delivery right away."""
+        entry_id = uuid.uuid4().hex
+        created_at = time.time()
+        with self._lock:
+            self._append({"op": "add", "id": entry_id, "alert": asdict(alert), "created_at": created_at})
+            self._entries[entry_id] = {
+                "alert": asdict(alert), "created_at": created_at, "attempts": 0, "next_attempt_at": 0.0,
+            }
+            self._in_flight.add(entry_id)
+        return entry_id
+
+    def claim_due(self) -> List[Tuple[str, Alert]]:
+        """Returns the alerts whose retry time has come and marks them as in flight."""
+        now = time.time()
+        due = []
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                if entry_id in self._in_flight:
+                    continue
+                if now - entry["created_at"] > self.max_age:
+                    logger.warning("Dropping stale undelivered alert: %s", entry["alert"]["title"])
+                    self._append({"op": "done", "id": entry_id})
+                    del self._entries[entry_id]
+                elif entry["next_attempt_at"] <= now:
+                    self._in_flight.add(entry_id)
+                    due.append((entry_id, Alert(**entry["alert"])))
+        return due
+
+    def mark_delivered(self, entry_id: str) -> None:
+        with self._lock:
+            self._in_flight.discard(entry_id)
+            if self._entries.pop(entry_id, None) is not None:
+                self._append({"op": "done", "id": entry_id})
+            if not self._entries:
+                # Nothing pending: start the next run from an empty file.
+                self._compact()
+
+    def mark_failed(self, entry_id: str) -> None:
+        with self._lock:
+            self._in_flight.discard(entry_id)
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return
+            entry["attempts"] += 1
+            entry["next_attempt_at"] = time.time() + min(self.base_delay * 2 ** (entry["attempts"] - 1), self.max_delay)
+            self._append({
+                "op": "fail", "id": entry_id,
+                "attempts": entry["attempts"], "next_attempt_at": entry["next_attempt_at"],
+            })
+
+
+class AlertDispatcher:
+    """Delivers ntfy.sh notifications concurrently over one pooled HTTP session.
+
+    submit() never blocks on the network; flush() waits for everything queued so far.
+    With digest=True all alerts queued before a flush are sent as a single notification.
+    With an outbox, every alert is persisted first and retried until it is delivered.
+    """
+
+    def __init__(
+        self,
+        ntfy_topic: Optional[str],
+        max_workers: int = 4,
+        timeout: float = 10.0,
+        digest: bool = False,
+        server: str = "https://ntfy.sh",
+        outbox: Optional[AlertOutbox] = None,
+    ) -> None:
+        self.ntfy_topic = ntfy_topic
+        self.outbox = outbox
+        self.timeout = timeout
+        self.digest = digest
+        self.server = server.rstrip("/")
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ntfy")
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+        self._batch: List[Alert] = []
+
+    def submit(self, alert: Alert) -> None:
+        if not self.ntfy_topic:
+            return
+        with self._lock:
+            if self.digest:
+                self._batch.append(alert)
+            else:
+                self._enqueue(alert)
+
+    def _enqueue(self, alert: Alert, entry_id: Optional[str] = None) -> None:
+        if entry_id is None and self.outbox is not None:
+            entry_id = self.outbox.add(alert)
+        self._pending.append(self._executor.submit(self._deliver, alert, entry_id))
+
+    def _deliver(self, alert: Alert, entry_id: Optional[str]) -> bool:
+        delivered = self._post(alert)
+        if entry_id is not None:
+            if delivered:
+                self.outbox.mark_delivered(entry_id)
+            else:
+                self.outbox.mark_failed(entry_id)
+        return delivered
+
+    def retry_pending(self) -> None:
+        """Starts redelivery of outbox alerts that are due, without waiting for them."""
+        if not self.ntfy_topic or self.outbox is None:
+            return
+        due = self.outbox.claim_due()
+        if due:
+            logger.info("Retrying %s undelivered alert(s).", len(due))
+        with self._lock:
+            for entry_id, alert in due:
+                self._enqueue(alert, entry_id)
+
+    @staticmethod
+    def _combine(alerts: List[Alert]) -> Alert:
+        if len(alerts) == 1:
+            return alerts[0]
+        lines = [f"{a.title.replace('🎉 Stock Alert: ', '')}\n{a.message}\n{a.click or ''}".strip() for a in alerts]
+        return Alert(title=f"🎉 Stock Alert: {len(alerts)} products are available!", message="\n\n".join(lines))
+
+    def _post(self, alert: Alert) -> bool:
+        headers = {"Title": alert.title.encode("utf-8"), "Tags": alert.tags}
+        if alert.click:
+            headers["Click"] = alert.click
+        try:
+            response = self.session.post(
+                f"{self.server}/{self.ntfy_topic}",
+                data=alert.message.encode("utf-8"),
+                headers=headers,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.error("Failed to send ntfy.sh notification: %s", e)
+            return False
+        logger.info("Sent ntfy.sh notification to topic: %s", self.ntfy_topic)
+        return True
+
+    def flush(self) -> Tuple[int, int]:
+        """Sends any digest and waits for queued deliveries. Returns (delivered, failed)."""
+        with self._lock:
+            if self._batch:
+                self._enqueue(self._combine(self._batch))
+                self._batch = []
+            pending, self._pending = self._pending, []
+        results = [future.result() for future in pending]
+        return sum(results), len(results) - sum(results)
+
+    def close(self) -> None:
+        self.flush()
+        self._executor.shutdown()
+        self.session.close()
+
+
+class Observation(NamedTuple):
+    timestamp: float
+    pincode: str
+    alias: str
+    available: bool
+    price: Optional[float]
+    inventory_quantity: Optional[int]
+
+
+class AvailabilityWindow(NamedTuple):
+    pincode: str
+    start: float
+    end: Optional[float]  # None while the product is still in stock
+
+
+class StockHistory:
+    """Append-only binary log of every availability observation, split into size-capped segments.
+
+    Each segment starts its own string table: a definition record maps a small id to a
+    pincode or alias the first time it is used, and observations refer to those ids, so
+    an observation takes 22 bytes on disk. Readers stream segments record by record.
+    """
+
+    _DEFINE = 0
+    _OBSERVE = 1
+    _TYPE = struct.Struct("<B")
+    _DEFINITION = struct.Struct("<HH")  # id, byte length of the utf-8 string that follows
+    _OBSERVATION = struct.Struct("<IHHBdi")  # timestamp, pincode id, alias id, available, price, inventory
+    _MAX_IDS = 1 << 16
+    _MAX_INVENTORY = (1 << 31) - 1
+
+    def __init__(self, directory: str = "history", max_segment_bytes: int = 8 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._segment: Optional[str] = None
+        self._ids: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        """(start timestamp, path) of every segment, oldest first."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith("history-") and name.endswith(".bin"):
+                segments.append((int(name[len("history-"):-len(".bin")]), os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _open_segment(self, timestamp: int, new: bool = False) -> None:
+        segments = self._segments()
+        if not new and segments and os.path.getsize(segments[-1][1]) < self.max_segment_bytes:
+            path = segments[-1][1]
+            # Rebuild the string table of the segment we are appending to.
+            strings, end = self._read_definitions(path)
+            self._ids = {text: string_id for string_id, text in strings.items()}
+            size = os.path.getsize(path)
+            if end < size:
+                # A write was cut short; appending after it would misalign every later record.
+                logger.warning("Dropping %s bytes of a torn record at the end of %s", size - end, path)
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        else:
+            if segments and timestamp <= segments[-1][0]:
+                timestamp = segments[-1][0] + 1
+            path = os.path.join(self.directory, f"history-{timestamp:010d}.bin")
+            self._ids = {}
+        self._segment = path
+
+    def _read_definitions(self, path: str) -> Tuple[Dict[int, str], int]:
+        """The string table of a segment and the byte length of its complete records."""
+        strings: Dict[int, str] = {}
+        end = 0
+        with open(path, "rb") as f:
+            for kind, fields in self._records(f):
+                if kind == self._DEFINE:
+                    strings[fields[0]] = fields[1]
+                end = f.tell()
+        return strings, end
+
+    def _string_id(self, text: str, ids: Dict[str, int], out: bytearray) -> int:
+        string_id = ids.get(text)
+        if string_id is None:
+            string_id = len(ids)
+            ids[text] = string_id
+            encoded = text.encode("utf-8")
+            out += self._TYPE.pack(self._DEFINE) + self._DEFINITION.pack(string_id, len(encoded)) + encoded
+        return string_id
+
+    def _inventory(self, quantity: Optional[int]) -> int:
+        if quantity is None:
+            return -1
+        return min(max(int(quantity), 0), self._MAX_INVENTORY)
+
+    def record(self, observations: List[Observation]) -> None:
+        """Appends observations (normally all of one check) in a single write."""
+        if not observations:
+            return
+        with self._lock:
+            timestamp = int(observations[0].timestamp)
+            if self._segment is None or (
+                os.path.exists(self._segment) and os.path.getsize(self._segment) >= self.max_segment_bytes
+            ):
+                self._open_segment(timestamp)
+            strings = {s for obs in observations for s in (obs.pincode, obs.alias)}
+            if len(self._ids) + len(strings - self._ids.keys()) > self._MAX_IDS:
+                # The string ids of this segment would overflow.
+                self._open_segment(timestamp, new=True)
+            # The string table only takes the new ids once they are safely on disk.
+            ids = dict(self._ids)
+            out = bytearray()
+            for obs in observations:
+                pincode_id = self._string_id(obs.pincode, ids, out)
+                alias_id = self._string_id(obs.alias, ids, out)
+                out += self._TYPE.pack(self._OBSERVE) + self._OBSERVATION.pack(
+                    int(obs.timestamp),
+                    pincode_id,
+                    alias_id,
+                    obs.available,
+                    float("nan") if obs.price is None else obs.price,
+                    self._inventory(obs.inventory_quantity),
+                )
+            try:
+                with open(self._segment, "ab") as f:
+                    f.write(out)
+            except OSError:
+                # Part of the batch may be on disk; reopening trims it before the next write.
+                self._segment = None
+                raise
+            self._ids = ids
+
+    def _records(self, f: BinaryIO) -> Iterator[Tuple[int, Tuple[Any, ...]]]:
+        """Yields (kind, fields) of each record, stopping at a torn or unreadable one."""
+        while True:
+            kind = f.read(self._TYPE.size)
+            if not kind:
+                return
+            if kind[0] == self._DEFINE:
+                header = f.read(self._DEFINITION.size)
+                if len(header) < self._DEFINITION.size:
+                    return
+                string_id, length = self._DEFINITION.unpack(header)
+                encoded = f.read(length)
+                if len(encoded) < length:
+                    return
+                try:
+                    text = encoded.decode("utf-8")
+                except UnicodeDecodeError:
+                    return
+                yield kind[0], (string_id, text)
+            elif kind[0] == self._OBSERVE:
+                raw = f.read(self._OBSERVATION.size)
+                if len(raw) < self._OBSERVATION.size:
+                    return  # Torn final record.
+                yield kind[0], self._OBSERVATION.unpack(raw)
+            else:
+                return
+
+    def _read_segment(self, path: str, strings: Dict[int, str]) -> Iterator[Observation]:
+        with open(path, "rb") as f:
+            for kind, fields in self._records(f):
+                if kind == self._DEFINE:
+                    strings[fields[0]] = fields[1]
+                    continue
+                timestamp, pincode_id, alias_id, available, price, inventory = fields
+                if pincode_id not in strings or alias_id not in strings:
+                    continue  # Its definition was lost to a torn write.
+                yield Observation(
+                    float(timestamp),
+                    strings[pincode_id],
+                    strings[alias_id],
+                    bool(available),
+                    None if math.isnan(price) else price,
+                    None if inventory < 0 else inventory,
+                )
+
+    def iter_observations(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        alias: Optional[str] = None,
+        pincode: Optional[str] = None,
+    ) -> Iterator[Observation]:
+        """Streams matching observations in time order, skipping segments outside the range."""
+        segments = self._segments()
+        for index, (start, path) in enumerate(segments):
+            next_start = segments[index + 1][0] if index + 1 < len(segments) else None
+            if since is not None and next_start is not None and next_start < since:
+                continue
+            if until is not None and start > until:
+                return
+            for obs in self._read_segment(path, {}):
+                if since is not None and obs.timestamp < since:
+                    continue
+                if until is not None and obs.timestamp > until:
+                    return
+                if (alias is None or obs.alias == alias) and (pincode is None or obs.pincode == pincode):
+                    yield obs
+
+    def availability_windows(
+        self,
+        alias: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        pincode: Optional[str] = None,
+    ) -> List[AvailabilityWindow]:
+        """Periods in which a product was observed in stock, per pincode.
+
+        A window starts at the first observation in stock and ends at the first one out of stock.
+        """
+        open_since: Dict[str, float] = {}
+        windows = []
+        for obs in self.iter_observations(since, until, alias=alias, pincode=pincode):
+            if obs.available and obs.pincode not in open_since:
+                open_since[obs.pincode] = obs.timestamp
+            elif not obs.available and obs.pincode in open_since:
+                windows.append(AvailabilityWindow(obs.pincode, open_since.pop(obs.pincode), obs.timestamp))
+        windows.extend(AvailabilityWindow(p, start, None) for p, start in open_since.items())
+        return sorted(windows, key=lambda w: w.start)
+
+
+FETCH_MODES = ("auto", "http", "selenium")
 
 
 class StockMonitor:
-    def __init__(self, pincode: str, target_products: List[str], ntfy_topic: Optional[str] = None, state_file: str = 'stock_status.json'):
+    def __init__(
+        self,
+        pincode: str,
+        target_products: Union[List[str], ProductMatcher],
+        ntfy_topic: Optional[str] = None,
+        state_file: Optional[str] = 'stock_status.json',
+        fetch_mode: str = "auto",
+        session_cache: Optional[SessionCache] = None,
+        reuse_clients: bool = False,
+        selenium_options: Optional[Dict[str, Any]] = None,
+        categories: Optional[List[str]] = None,
+        page_concurrency: int = 4,
+        report: Optional[RunReport] = None,
+        alert_options: Optional[Dict[str, Any]] = None,
+        state_store: Optional[StateStore] = None,
+        history: Optional[StockHistory] = None,
+        dispatcher: Optional[AlertDispatcher] = None,
+    ):
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode {fetch_mode!r}, expected one of {', '.join(FETCH_MODES)}")
         self.pincode = pincode
-        self.target_products = {p.lower() for p in target_products}
+        self.fetch_mode = fetch_mode
+        self.categories = categories or ["protein"]
+        self.page_concurrency = page_concurrency
+        self.report = report or RunReport()
+        self.session_cache = session_cache
+        # Outlives the clients, so a recycled browser still recognizes an unchanged catalog.
+        self.catalog_cache = CatalogCache()
+        self._catalog_unchanged = False
+        self._in_stock = 0
+        # Whether stock_status reflects the last catalog applied, and what that catalog looked like,
+        # so an unchanged catalog can be skipped but still recorded in the history log.
+        self._catalog_applied = False
+        self._observations: List[Observation] = []
+        # Set by the browser's page agent when it sees a change (see MonitorDaemon).
+        self.change_event: Optional[threading.Event] = None
+        # The catalog fetched by the latest check and the store it was served for.
+        self.last_products: Optional[List[Product]] = None
+        self.store: Optional[str] = None
+        # Long-running callers keep the browser and HTTP session warm between checks.
+        self.reuse_clients = reuse_clients
+        self._clients: Dict[str, Any] = {}
+        # Extra keyword arguments for AmulAPIClient, e.g. resource blocking settings.
+        self.selenium_options = selenium_options or {}
+        if not isinstance(target_products, ProductMatcher):
+            target_products = ProductMatcher(target_products)
+        self.matcher = target_products
         self.ntfy_topic = ntfy_topic
+        # A dispatcher passed in is shared with other monitors; whoever created it flushes and closes it.
+        # Otherwise alert_options are extra keyword arguments for our own, e.g. digest mode and concurrency.
+        self._owns_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher or AlertDispatcher(ntfy_topic, **(alert_options or {}))
         self.state_file = state_file
+        if state_store is None and state_file is not None:
+            state_store = JSONStateStore(state_file)
+        self.state_store = state_store
+        self.history = history
         self.stock_status: Dict[str, bool] = self._load_state()
-        logger.info("Monitoring for products: %s", ", ".join(target_products) if target_products else "all protein products")
+        # Price and inventory of the monitored products seen in the latest check.
+        self.product_details: ProductDetails = {}
+        logger.info("Monitoring for products: %s", ", ".join(self.matcher.rules) if self.matcher else f"all products in {', '.join(self.categories)}")
 
     def _load_state(self) -> Dict[str, bool]:
-        """Loads the last known stock status from a file."""
-        try:
-            with open(self.state_file, 'r') as f:
-                state = json.load(f)
-                logger.info("Loaded previous stock status from %s", self.state_file)
-                return state
-        except (FileNotFoundError, json.JSONDecodeError):
-            logger.warning("Could not load previous state. Starting fresh.")
+        """Loads the last known stock status from the state store."""
+        if self.state_store is None:
             return {}
+        return self.state_store.load(self.pincode)
 
+    @timed_phase("state_save")
     def _save_state(self, new_state: Dict[str, bool]):
-        """Saves the current stock status to a file."""
-        with open(self.state_file, 'w') as f:
-            json.dump(new_state, f, indent=2)
-        logger.info("Saved current stock status to %s", self.state_file)
+        """Saves the current stock status to the state store."""
+        if self.state_store is None:
+            return
+        self.state_store.save({self.pincode: new_state}, {self.pincode: self.product_details})
+
+    def _get_client(self, engine: str):
+        client = self._clients.get(engine)
+        if client is None:
+            if engine == "http":
+                client = AmulHTTPClient(
+                    pincode=self.pincode,
+                    session_cache=self.session_cache,
+                    categories=self.categories,
+                    page_concurrency=self.page_concurrency,
+                    report=self.report,
+                    catalog_cache=self.catalog_cache,
+                )
+            else:
+                client = AmulAPIClient(
+                    pincode=self.pincode,
+                    session_cache=self.session_cache,
+                    categories=self.categories,
+                    page_concurrency=self.page_concurrency,
+                    report=self.report,
+                    catalog_cache=self.catalog_cache,
+                    **self.selenium_options,
+                )
+            self._clients[engine] = client
+        # Reused clients report into whichever report the current check uses.
+        client.report = self.report
+        if engine == "selenium":
+            client.change_event = self.change_event
+        return client
 
-    def run_check(self):
-        """Performs a single stock check, sends alerts, and saves state."""
+    def close_clients(self, engine: Optional[str] = None) -> None:
+        """Shuts down the cached clients (all of them, or only the given engine)."""
+        for name in [engine] if engine else list(self._clients):
+            client = self._clients.pop(name, None)
+            if client is not None:
+                client.close()
+
+    def browser_memory_mb(self) -> Optional[float]:
+        client = self._clients.get("selenium")
+        return client.memory_mb() if client is not None else None
+
+    def _fetch_from(self, engine: str) -> Optional[List[Product]]:
+        client = self._get_client(engine)
+        if not client.store_selected and not client.set_store_preferences():
+            return None
+        products = client.get_products()
+        self._catalog_unchanged = client.catalog_unchanged
+        self.store = client.substore or self.store
+        return products
+
+    @timed_phase("fetch")
+    def _fetch_products(self) -> Optional[List[Product]]:
+        """Fetches the product list, preferring the direct API and falling back to Selenium.
+
+        Returns None if the store could not be selected at all.
+        """
+        self._catalog_unchanged = False
+        try:
+            if self.fetch_mode in ("auto", "http"):
+                try:
+                    products_data = self._fetch_from("http")
+                    if products_data or self.fetch_mode == "http":
+                        return products_data
+                except (requests.RequestException, ValueError) as e:
+                    self.close_clients("http")
+                    if self.fetch_mode == "http":
+                        raise
+                    logger.warning("Direct API fetch failed: %s", e)
+                logger.warning("Falling back to Selenium for this check.")
+            return self._fetch_from("selenium")
+        finally:
+            if not self.reuse_clients:
+                self.close_clients()
+
+    @timed_phase("diffing")
+    def _apply_products(
+        self,
+        products: List[Product],
+        new_stock_status: Dict[str, bool],
+        summary: CheckSummary,
+    ) -> None:
+        """Compares fetched products with the previous status, alerting on restocks."""
+        # Keep track of products seen in this run to handle products that are no longer listed
+        seen_products = set()
+        self.product_details = {}
+        observed_at = time.time()
+        observations: List[Observation] = []
+
+        for product in products:
+            seen_products.add(product.key)
+
+            if self.matcher.match(product.name, product.alias) is not None:
+                previous_status = self.stock_status.get(product.key, False)
+
+                # Alert only if it was unavailable and is now available
+                if not previous_status and product.available:
+                    self.send_alert(product)
+                    summary.alerts_sent += 1
+                    self.report.incr("alerts_sent")
+
+                summary.in_stock += product.available
+                new_stock_status[product.key] = product.available
+                self.product_details[product.key] = (product.price, product.inventory_quantity)
+                observations.append(Observation(
+                    observed_at,
+                    self.pincode,
+                    product.alias,
+                    product.available,
+                    product.price,
+                    product.inventory_quantity,
+                ))
+
+        # If monitoring specific products, check if any of them disappeared from the API response
+        if self.matcher.names:
+            missing_products = set(self.matcher.names) - seen_products
+            for product_name in missing_products:
+                new_stock_status[product_name] = False
+
+        self._observations = observations
+        if self.history is not None:
+            self.history.record(observations)
+
+    def run_check(self, products: Optional[List[Product]] = None) -> CheckSummary:
+        """Performs a single stock check, sends alerts, and saves state.
+
+        products, if given, is the catalog of this pincode's store as already fetched for
+        another pincode served by the same store; it is used instead of fetching again.
+        """
         logger.info("Starting stock check for pincode %s", self.pincode)
+        self.report.incr("checks")
+        summary = CheckSummary(pincode=self.pincode)
         new_stock_status = self.stock_status.copy()
+        self.last_products = None
+        # Alerts that failed earlier are redelivered in the background while we fetch.
+        if self._owns_dispatcher:
+            self.dispatcher.retry_pending()
         try:
-            client = AmulAPIClient(pincode=self.pincode)
-            if not client.set_store_preferences():
+            if products is None:
+                products_data = self._fetch_products()
+            else:
+                products_data = products
+                self._catalog_unchanged = False
+                self.report.incr("shared_fetches")
+            self.last_products = products_data
+            if products_data is None:
                 logger.error("Failed to set store preferences. Aborting check.")
-                return
+                return summary
 
-            products_data = client.get_products()
+            summary.ok = True
+            summary.products_scanned = len(products_data)
+            self.report.incr("products_scanned", len(products_data))
             if not products_data:
                 logger.warning("No products found in this check.")
                 # This ensures that if they become available later, an alert is sent.
-                for product_name in self.target_products:
+                for product_name in self.matcher.names:
                     new_stock_status[product_name] = False
-                return
+                # The status no longer matches the cached catalog, so it must be applied again.
+                self._catalog_applied = False
+                self.catalog_cache.clear()
+                return summary
 
-            # Keep track of products seen in this run to handle products that are no longer listed
-            seen_products = set()
-
-            for product_info in products_data:
-                product_name = product_info.get("name", "").lower()
-                seen_products.add(product_name)
-
-                if not self.target_products or product_name in self.target_products:
-                    is_available = bool(product_info.get("available", False))
-                    
-                    previous_status = self.stock_status.get(product_name, False)
-
-                    # Alert only if it was unavailable and is now available
-                    if not previous_status and is_available:
-                        product = Product(
-                            alias=product_info.get("alias"),
-                            name=product_info.get("name"),
-                            available=is_available,
-                            url=f"https://shop.amul.com/en/product/{product_info.get('alias')}",
-                            price=product_info.get("price"),
-                            inventory_quantity=product_info.get("inventory_quantity", 0),
-                        )
-                        self.send_alert(product)
-
-                    new_stock_status[product_name] = is_available
-
-            # If monitoring specific products, check if any of them disappeared from the API response
-            if self.target_products:
-                missing_products = self.target_products - seen_products
-                for product_name in missing_products:
-                    new_stock_status[product_name] = False
+            if self._catalog_unchanged and self._catalog_applied:
+                # Same catalog as the previous check, so status, details and alerts cannot differ either.
+                logger.info("Catalog unchanged since the last check.")
+                self.report.incr("catalogs_unchanged")
+                summary.in_stock = self._in_stock
+                if self.history is not None:
+                    now = time.time()
+                    self.history.record([obs._replace(timestamp=now) for obs in self._observations])
+                return summary
+
+            self._catalog_applied = False
+            self._apply_products(products_data, new_stock_status, summary)
+            self._in_stock = summary.in_stock
+            self._catalog_applied = True
 
         except Exception as e:
+            summary.ok = False
+            self.report.incr("check_errors")
             logger.error("An error occurred during stock check: %s", e, exc_info=True)
+            # A broken browser or session must not be reused by the next check.
+            self.close_clients()
+            # Nor may a catalog that was never fully applied be skipped as unchanged.
+            self._catalog_applied = False
+            self.catalog_cache.clear()
         finally:
+            if self._owns_dispatcher:
+                with self.report.span("alert_delivery"):
+                    self.dispatcher.flush()
             # Always save the latest status
             self._save_state(new_stock_status)
+            self.stock_status = new_stock_status
+        return summary
 
+    @timed_phase("alerts")
     def send_alert(self, product: Product):
-        """Sends a notification when a product is in stock."""
-        title = f"🎉 Stock Alert: {product.name} is available!"
-        message = f"Price: ₹{product.price}\nStock: {product.inventory_quantity}"
-        
-        logger.info(title)
-        logger.info(message)
+        """Queues a notification that a product is in stock; delivered when the check finishes."""
+        alert = Alert(
+            title=f"🎉 Stock Alert: {product.name} is available!",
+            message=f"Price: {product.price_text}\nStock: {product.inventory_quantity}\nPincode: {self.pincode}",
+            click=product.url,
+        )
+        logger.info(alert.title)
+        logger.info(alert.message)
         logger.info("URL: %s", product.url)
+        self.dispatcher.submit(alert)
 
-        if self.ntfy_topic:
-            try:
-                requests.post(
-                    f"https://ntfy.sh/{self.ntfy_topic}",
-                    data=message.encode('utf-8'),
-                    headers={
-                        "Title": title.encode('utf-8'),
-                        "Click": product.url,
-                        "Tags": "tada,shopping_cart"
-                    }
-                )
-                logger.info("Sent ntfy.sh notification to topic: %s", self.ntfy_topic)
-            except Exception as e:
-                logger.error("Failed to send ntfy.sh notification: %s", e)
+    def close(self) -> None:
+        """Shuts down the clients, and the dispatcher and state store this monitor owns."""
+        self.close_clients()
+        if self._owns_dispatcher:
+            self.dispatcher.close()
+        if self.state_store is not None:
+            self.state_store.close()
 
 
-import os
+class MultiPincodeMonitor:
+    """Checks several pincodes concurrently, keeping their state in one store keyed by pincode."""
+
+    def __init__(
+        self,
+        pincodes: List[str],
+        target_products: List[str],
+        ntfy_topic: Optional[str] = None,
+        state_file: str = 'stock_status.json',
+        pool_size: int = 4,
+        state_store: Optional[StateStore] = None,
+        store_resolver: Optional[StoreResolver] = None,
+        alert_options: Optional[Dict[str, Any]] = None,
+        **monitor_kwargs: Any,
+    ):
+        self.state_store = state_store or JSONStateStore(state_file)
+        # One dispatcher for every pincode, so a digest covers the whole run and there is one HTTP pool.
+        self.dispatcher = AlertDispatcher(ntfy_topic, **(alert_options or {}))
+        self.pool_size = max(1, pool_size)
+        # Without a resolver every pincode fetches its own catalog.
+        self.store_resolver = store_resolver
+        self.monitors: Dict[str, StockMonitor] = {}
+        # With reuse_clients, pincodes whose browser is kept warm but not in use, least recently used first.
+        # Together with the checks in progress they never hold more than pool_size browsers.
+        self._idle_browsers: "OrderedDict[str, StockMonitor]" = OrderedDict()
+        self._checks_running = 0
+        self._browser_lock = threading.Lock()
+        matcher = ProductMatcher(target_products)
+        for pincode in pincodes:
+            # Each monitor works purely in memory; this class owns the state store.
+            monitor = StockMonitor(
+                pincode, matcher, ntfy_topic, state_file=None, dispatcher=self.dispatcher, **monitor_kwargs
+            )
+            monitor.stock_status = self.state_store.load(pincode)
+            self.monitors[pincode] = monitor
+        self.report = RunReport()
+
+    @property
+    def report(self) -> RunReport:
+        return self._report
+
+    @report.setter
+    def report(self, report: RunReport) -> None:
+        self._report = report
+        for monitor in self.monitors.values():
+            monitor.report = report
+
+    @property
+    def change_event(self) -> Optional[threading.Event]:
+        return next(iter(self.monitors.values())).change_event if self.monitors else None
+
+    @change_event.setter
+    def change_event(self, event: Optional[threading.Event]) -> None:
+        for monitor in self.monitors.values():
+            monitor.change_event = event
+
+    @property
+    def reuse_clients(self) -> bool:
+        return all(m.reuse_clients for m in self.monitors.values())
+
+    @reuse_clients.setter
+    def reuse_clients(self, value: bool) -> None:
+        for monitor in self.monitors.values():
+            monitor.reuse_clients = value
+
+    @timed_phase("state_save")
+    def _save_state(self) -> None:
+        self.state_store.save(
+            {pincode: m.stock_status for pincode, m in self.monitors.items()},
+            {pincode: m.product_details for pincode, m in self.monitors.items()},
+        )
+
+    def close_clients(self, engine: Optional[str] = None) -> None:
+        for monitor in self.monitors.values():
+            monitor.close_clients(engine)
+        if engine in (None, "selenium"):
+            with self._browser_lock:
+                self._idle_browsers.clear()
+
+    def close(self) -> None:
+        for monitor in self.monitors.values():
+            monitor.close()
+        self.dispatcher.close()
+        self.state_store.close()
+        if self.store_resolver is not None:
+            self.store_resolver.close()
+
+    def browser_memory_mb(self) -> Optional[float]:
+        usage = [m.browser_memory_mb() for m in self.monitors.values()]
+        usage = [mb for mb in usage if mb is not None]
+        return sum(usage) if usage else None
+
+    def _evict_browsers(self) -> List[StockMonitor]:
+        evicted = []
+        while self._idle_browsers and len(self._idle_browsers) + self._checks_running > self.pool_size:
+            evicted.append(self._idle_browsers.popitem(last=False)[1])
+        return evicted
+
+    def _run_monitor(self, monitor: StockMonitor, products: Optional[List[Product]] = None) -> CheckSummary:
+        """Runs one pincode's check, closing the least recently used idle browsers beyond pool_size."""
+        with self._browser_lock:
+            self._idle_browsers.pop(monitor.pincode, None)
+            self._checks_running += 1
+            evicted = self._evict_browsers()
+        for other in evicted:
+            other.close_clients("selenium")
+        try:
+            return monitor.run_check(products)
+        finally:
+            with self._browser_lock:
+                self._checks_running -= 1
+                if "selenium" in monitor._clients:
+                    self._idle_browsers[monitor.pincode] = monitor
+                evicted = self._evict_browsers()
+            for other in evicted:
+                other.close_clients("selenium")
+
+    def _group_by_store(self, pool: ThreadPoolExecutor) -> List[List[StockMonitor]]:
+        """Groups the monitors by the store serving their pincode; unresolved pincodes stay on their own."""
+        if self.store_resolver is None:
+            return [[m] for m in self.monitors.values()]
+        stores = pool.map(self.store_resolver.resolve, self.monitors)
+        groups: Dict[str, List[StockMonitor]] = {}
+        for (pincode, monitor), store in zip(self.monitors.items(), stores):
+            groups.setdefault(f"store:{store}" if store else f"pincode:{pincode}", []).append(monitor)
+        return list(groups.values())
+
+    def _check_group(self, monitors: List[StockMonitor]) -> List[CheckSummary]:
+        """Fetches the catalog once for the first pincode of a store and shares it with the others."""
+        leader, *followers = monitors
+        summaries = [self._run_monitor(leader)]
+        expected = self.store_resolver.get(leader.pincode) if self.store_resolver else None
+        if leader.store and self.store_resolver is not None:
+            self.store_resolver.put(leader.pincode, leader.store)
+        shared = leader.last_products
+        if leader.store and expected and leader.store != expected:
+            logger.warning(
+                "Pincode %s was served by store %s, not %s. Checking the rest of its group separately.",
+                leader.pincode, leader.store, expected,
+            )
+            shared = None
+        for monitor in followers:
+            summaries.append(self._run_monitor(monitor, shared))
+            if shared is None and monitor.store and self.store_resolver is not None:
+                self.store_resolver.put(monitor.pincode, monitor.store)
+        return summaries
+
+    def run_check(self) -> List[CheckSummary]:
+        """Checks every store through a bounded worker pool and saves the combined state."""
+        self.dispatcher.retry_pending()
+        try:
+            with ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+                groups = self._group_by_store(pool)
+                results = [s for group in pool.map(self._check_group, groups) for s in group]
+        finally:
+            with self.report.span("alert_delivery"):
+                self.dispatcher.flush()
+        if len(groups) < len(self.monitors):
+            logger.info("%s pincodes are served by %s store(s).", len(self.monitors), len(groups))
+        by_pincode = {s.pincode: s for s in results}
+        summaries = [by_pincode[pincode] for pincode in self.monitors]
+        self._save_state()
+
+        logger.info("Run summary:")
+        for s in summaries:
+            logger.info(
+                "  %s %s: %s products, %s in stock, %s alerts",
+                "✅" if s.ok else "❌", s.pincode, s.products_scanned, s.in_stock, s.alerts_sent,
+            )
+        logger.info(
+            "%s/%s pincodes checked, %s alerts sent.",
+            sum(s.ok for s in summaries), len(summaries), sum(s.alerts_sent for s in summaries),
+        )
+        return summaries
+
+
+class AdaptiveScheduler:
+    """Chooses the poll interval from when restocks were seen before.
+
+    Restocks (unavailable -> available transitions) from the history log are counted per
+    time-of-week bucket, smoothed over neighbouring buckets and normalised. Buckets where
+    restocks are common are polled every min_interval, quiet ones back off towards
+    max_interval. Without any recorded restock the default interval is used.
+    """
+
+    def __init__(
+        self,
+        history: StockHistory,
+        min_interval: float = 30.0,
+        max_interval: float = 900.0,
+        default_interval: float = 60.0,
+        lookback_days: float = 28.0,
+        bucket_minutes: int = 30,
+        spread: int = 1,
+        refresh_every: float = 3600.0,
+    ) -> None:
+        self.history = history
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.lookback_days = lookback_days
+        self.bucket_minutes = bucket_minutes
+        self.spread = spread
+        self.refresh_every = refresh_every
+        self.buckets = 7 * 24 * 60 // bucket_minutes
+        self._scores: Optional[List[float]] = None
+        self._refreshed_at = 0.0
+        self.last_check_at: Optional[float] = None
+
+    def _bucket(self, timestamp: float) -> int:
+        t = time.localtime(timestamp)
+        return (t.tm_wday * 24 * 60 + t.tm_hour * 60 + t.tm_min) // self.bucket_minutes
+
+    def refresh(self, now: Optional[float] = None) -> None:
+        """Rebuilds the restock profile from the history log."""
+        now = time.time() if now is None else now
+        counts = [0.0] * self.buckets
+        last_seen: Dict[Tuple[str, str], bool] = {}
+        restocks = 0
+        for obs in self.history.iter_observations(since=now - self.lookback_days * 86400):
+            key = (obs.pincode, obs.alias)
+            if obs.available and last_seen.get(key) is False:
+                counts[self._bucket(obs.timestamp)] += 1
+                restocks += 1
+            last_seen[key] = obs.available
+            self.last_check_at = obs.timestamp
+        self._refreshed_at = now
+        if not restocks:
+            self._scores = None
+            return
+        smoothed = [
+            sum(counts[(i + d) % self.buckets] / (1 + abs(d)) for d in range(-self.spread, self.spread + 1))
+            for i in range(self.buckets)
+        ]
+        peak = max(smoothed)
+        self._scores = [value / peak for value in smoothed]
+        logger.info("Adaptive polling learned from %s restock(s) in the last %s days.", restocks, self.lookback_days)
+
+    def interval_at(self, timestamp: Optional[float] = None) -> float:
+        now = time.time() if timestamp is None else timestamp
+        if now - self._refreshed_at > self.refresh_every:
+            self.refresh(now)
+        if self._scores is None:
+            return self.default_interval
+        score = self._scores[self._bucket(now)]
+        return self.max_interval - (self.max_interval - self.min_interval) * score
+
+    def is_due(self, now: Optional[float] = None) -> bool:
+        """For scheduled (cron) runs: whether enough time has passed since the last recorded check."""
+        now = time.time() if now is None else now
+        interval = self.interval_at(now)
+        return self.last_check_at is None or now - self.last_check_at >= interval
+
+
+class MonitorDaemon:
+    """Runs checks on an interval with a single long-lived browser until SIGTERM/SIGINT."""
+
+    def __init__(
+        self,
+        monitor: Union[StockMonitor, MultiPincodeMonitor],
+        interval: float = 60.0,
+        jitter: float = 10.0,
+        recycle_after: int = 100,
+        max_browser_mb: Optional[float] = None,
+        report_path: Optional[str] = None,
+        prometheus_path: Optional[str] = None,
+        scheduler: Optional[AdaptiveScheduler] = None,
+    ) -> None:
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.report_path = report_path
+        self.prometheus_path = prometheus_path
+        self.monitor.reuse_clients = True
+        self.interval = interval
+        self.jitter = jitter
+        self.recycle_after = recycle_after
+        self.max_browser_mb = max_browser_mb
+        self.checks_since_recycle = 0
+        self._stop = threading.Event()
+        # Set on shutdown, and by a browser page agent that saw a change, to cut the wait short.
+        self._wake = threading.Event()
+        self.monitor.change_event = self._wake
+
+    def stop(self, *_: Any) -> None:
+        logger.info("Shutdown requested, finishing current check.")
+        self._stop.set()
+        self._wake.set()
+
+    def _maybe_recycle(self) -> None:
+        self.checks_since_recycle += 1
+        reason = None
+        if self.recycle_after and self.checks_since_recycle >= self.recycle_after:
+            reason = f"{self.checks_since_recycle} checks"
+        elif self.max_browser_mb:
+            memory = self.monitor.browser_memory_mb()
+            if memory is not None and memory > self.max_browser_mb:
+                reason = f"{memory:.0f} MB resident"
+        if reason:
+            logger.info("♻️ Recycling browser after %s.", reason)
+            self.monitor.close_clients("selenium")
+            self.checks_since_recycle = 0
+
+    def next_delay(self) -> float:
+        interval = self.scheduler.interval_at() if self.scheduler else self.interval
+        return max(0.0, interval + random.uniform(-self.jitter, self.jitter))
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if self.scheduler:
+            logger.info(
+                "Daemon started: adaptive polling every %s-%ss (±%ss).",
+                self.scheduler.min_interval, self.scheduler.max_interval, self.jitter,
+            )
+        else:
+            logger.info("Daemon started: polling every %ss (±%ss).", self.interval, self.jitter)
+        try:
+            while not self._stop.is_set():
+                self._wake.clear()
+                self.monitor.report = RunReport()
+                self.monitor.run_check()
+                self.monitor.report.write(self.report_path, self.prometheus_path)
+                self._maybe_recycle()
+                if self._wake.wait(self.next_delay()) and not self._stop.is_set():
+                    logger.info("🔔 The page agent reported a change, checking now.")
+        finally:
+            self.monitor.close()
+            logger.info("Daemon stopped.")
 
 
 def main():
     """Main function to run the stock monitor."""
+    parser = argparse.ArgumentParser(description="Amul stock monitor")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="keep running and poll on an interval instead of checking once",
+    )
+    parser.add_argument(
+        "--windows", metavar="ALIAS",
+        help="print when the product with this alias was in stock, from the history log, and exit",
+    )
+    parser.add_argument("--days", type=float, default=30, help="how far back --windows looks (default 30)")
+    args = parser.parse_args()
+
     # --- Configuration is read from environment variables ---
-    PINCODE = os.getenv("PINCODE", "")
+    # Unless noted otherwise, an empty variable (e.g. an unset GitHub secret) keeps the default.
+    # PINCODE may be a comma-separated list to monitor several delivery areas in one run.
+    PINCODES = [p.strip() for p in os.getenv("PINCODE", "").split(',') if p.strip()]
     
-    # TARGET_PRODUCTS should be a comma-separated string in the environment variable.
+    # TARGET_PRODUCTS should be a comma-separated string in the environment variable,
+    # or one rule per line when a rule itself contains commas (e.g. "re:pack of \d{1,3}").
     # e.g., "amul high protein blueberry shake, 200 ml | pack of 8,amul high protein paneer, 400 g | pack of 2"
+    # Entries may also be "alias:<alias>", "glob:<pattern>", "re:<regex>" or "fuzzy:<words>".
     # An empty string will monitor all products.
     target_products_str = os.getenv("TARGET_PRODUCTS", "")
-    TARGET_PRODUCTS = [p.strip() for p in target_products_str.split(',') if p.strip()]
+    separator = "\n" if "\n" in target_products_str.strip() else ","
+    TARGET_PRODUCTS = [p.strip() for p in target_products_str.split(separator) if p.strip()]
     
     # It's recommended to set NTFY_TOPIC as a secret in your GitHub repository settings.
     NTFY_TOPIC = os.getenv("NTFY_TOPIC")
+
+    # "auto" calls the API directly and only starts Chrome if that fails; "http" or "selenium" force one engine.
+    FETCH_MODE = (os.getenv("FETCH_MODE") or "auto").strip().lower()
+
+    # Cookies that pin the session to the pincode's store are reused for this many hours (0 disables the cache).
+    SESSION_CACHE_TTL_HOURS = float(os.getenv("SESSION_CACHE_TTL_HOURS") or "6")
+
+    # Daemon mode only: seconds between checks (± jitter), and when to restart the browser.
+    POLL_INTERVAL = float(os.getenv("POLL_INTERVAL") or "60")
+    POLL_JITTER = float(os.getenv("POLL_JITTER") or "10")
+    RECYCLE_AFTER = int(os.getenv("RECYCLE_AFTER") or "100")
+    MAX_BROWSER_MB = float(os.getenv("MAX_BROWSER_MB") or "0") or None
+
+    # Comma-separated category slugs from shop.amul.com/en/browse/<category>, e.g. "protein,dairy".
+    CATEGORIES = [c.strip() for c in (os.getenv("CATEGORIES") or "protein").split(',') if c.strip()]
+    PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY") or "4")
+
+    # Skip images, fonts and trackers in the browser. Patterns use Chrome's "*" wildcard syntax.
+    BLOCK_RESOURCES = (os.getenv("BLOCK_RESOURCES") or "true").strip().lower() not in ("0", "false", "no")
+    # BLOCKED_URL_PATTERNS adds to the block list; UNBLOCKED_URL_PATTERNS removes entries from it by exact pattern.
+    BLOCKED_URL_PATTERNS = [p.strip() for p in os.getenv("BLOCKED_URL_PATTERNS", "").split(',') if p.strip()]
+    UNBLOCKED_URL_PATTERNS = [p.strip() for p in os.getenv("UNBLOCKED_URL_PATTERNS", "").split(',') if p.strip()]
+    # After the first page load, call the products API with fetch() from the page instead of navigating.
+    IN_PAGE_FETCH = (os.getenv("IN_PAGE_FETCH") or "true").strip().lower() not in ("0", "false", "no")
+    # "fetch" reads API responses with CDP Fetch interception and leaves Chrome's performance log off;
+    # "log" scrapes them from the performance log. "fetch" falls back to "log" where it is unavailable.
+    CAPTURE_MODE = (os.getenv("CAPTURE_MODE") or "fetch").strip().lower()
+    # Which events the performance log buffers in "log" mode: "network" (default) or "full" (also Page events).
+    LOG_PROFILE = (os.getenv("LOG_PROFILE") or "network").strip().lower()
+    # Daemon mode with the browser only: seconds between refreshes by a poller left running in the page,
+    # which wakes the daemon as soon as something changes (0 disables it).
+    PAGE_AGENT_INTERVAL = float(os.getenv("PAGE_AGENT_INTERVAL") or "0")
+
+    # Alerts: send every restock of a check as one notification, how many to send at once, and the per-request timeout.
+    ALERT_DIGEST = (os.getenv("ALERT_DIGEST") or "false").strip().lower() in ("1", "true", "yes")
+    ALERT_CONCURRENCY = int(os.getenv("ALERT_CONCURRENCY") or "4")
+    ALERT_TIMEOUT = float(os.getenv("ALERT_TIMEOUT") or "10")
+    # Undelivered alerts are kept here and retried on later checks (empty disables it).
+    ALERT_OUTBOX = os.getenv("ALERT_OUTBOX", "alert_outbox.jsonl")
+
+    # "json" keeps stock_status.json (read by the configuration UI); "sqlite" uses a database at STATE_FILE.
+    STATE_BACKEND = (os.getenv("STATE_BACKEND") or "json").strip().lower()
+    STATE_FILE = os.getenv("STATE_FILE") or ("stock_status.db" if STATE_BACKEND == "sqlite" else "stock_status.json")
+
+    # Optional machine-readable timing report of each run (JSON and/or Prometheus text format).
+    RUN_REPORT = os.getenv("RUN_REPORT")
+    RUN_REPORT_PROMETHEUS = os.getenv("RUN_REPORT_PROMETHEUS")
+
+    # How many pincodes are checked at the same time when several are configured.
+    POOL_SIZE = int(os.getenv("POOL_SIZE") or "4")
+    # Pincodes served by the same store share one fetch; their stores are cached for this many hours (0 disables it).
+    STORE_CACHE_TTL_HOURS = float(os.getenv("STORE_CACHE_TTL_HOURS") or "168")
     
+    # Every observation is appended to a compact history log here (empty disables it).
+    HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+
+    # Poll more often at the times of day/week restocks were seen before, and less otherwise.
+    # Scheduled runs skip the check when the last one was more recent than the learned interval.
+    ADAPTIVE_POLLING = (os.getenv("ADAPTIVE_POLLING") or "false").strip().lower() in ("1", "true", "yes")
+    POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL") or "30")
+    POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL") or "900")
+
     # --- End of Configuration ---
 
+    history = StockHistory(HISTORY_DIR) if HISTORY_DIR else None
+    scheduler = None
+    if ADAPTIVE_POLLING and history is not None:
+        scheduler = AdaptiveScheduler(
+            history,
+            min_interval=POLL_MIN_INTERVAL,
+            max_interval=POLL_MAX_INTERVAL,
+            default_interval=POLL_INTERVAL,
+        )
+    if args.windows:
+        if history is None:
+            parser.error("--windows needs HISTORY_DIR")
+        for window in history.availability_windows(args.windows, since=time.time() - args.days * 86400):
+            end = time.strftime("%Y-%m-%d %H:%M", time.localtime(window.end)) if window.end else "now"
+            print(f"{window.pincode}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(window.start))} → {end}")
+        return
+
     if not NTFY_TOPIC:
         logger.warning("NTFY_TOPIC environment variable not set. Push notifications will be disabled.")
 
-    monitor = StockMonitor(
-        pincode=PINCODE, 
-        target_products=TARGET_PRODUCTS,
-        ntfy_topic=NTFY_TOPIC,
+    if STATE_BACKEND not in STATE_BACKENDS:
+        raise ValueError(f"Unknown state backend {STATE_BACKEND!r}, expected one of {', '.join(STATE_BACKENDS)}")
+    state_store = STATE_BACKENDS[STATE_BACKEND](STATE_FILE)
+
+    monitor_kwargs = dict(
+        fetch_mode=FETCH_MODE,
+        history=history,
+        categories=CATEGORIES,
+        page_concurrency=PAGE_CONCURRENCY,
+        alert_options=dict(
+            digest=ALERT_DIGEST,
+            max_workers=ALERT_CONCURRENCY,
+            timeout=ALERT_TIMEOUT,
+            # Undelivered alerts of every pincode go to the same outbox.
+            outbox=AlertOutbox(ALERT_OUTBOX) if ALERT_OUTBOX and NTFY_TOPIC else None,
+        ),
+        session_cache=SessionCache(ttl=SESSION_CACHE_TTL_HOURS * 3600) if SESSION_CACHE_TTL_HOURS > 0 else None,
+        selenium_options=dict(
+            block_resources=BLOCK_RESOURCES,
+            blocked_patterns=blocked_url_patterns(BLOCKED_URL_PATTERNS, UNBLOCKED_URL_PATTERNS),
+            in_page_fetch=IN_PAGE_FETCH,
+            agent_interval=PAGE_AGENT_INTERVAL if args.daemon else 0.0,
+            capture=CAPTURE_MODE,
+            log_profile=LOG_PROFILE,
+        ),
     )
-    monitor.run_check()
+    if len(PINCODES) > 1:
+        monitor = MultiPincodeMonitor(
+            pincodes=PINCODES,
+            target_products=TARGET_PRODUCTS,
+            ntfy_topic=NTFY_TOPIC,
+            pool_size=POOL_SIZE,
+            state_store=state_store,
+            store_resolver=StoreResolver(ttl=STORE_CACHE_TTL_HOURS * 3600) if STORE_CACHE_TTL_HOURS > 0 else None,
+            **monitor_kwargs,
+        )
+    else:
+        monitor = StockMonitor(
+            pincode=PINCODES[0] if PINCODES else "",
+            target_products=TARGET_PRODUCTS,
+            ntfy_topic=NTFY_TOPIC,
+            state_store=state_store,
+            **monitor_kwargs,
+        )
+    if args.daemon:
+        MonitorDaemon(
+            monitor,
+            interval=POLL_INTERVAL,
+            jitter=POLL_JITTER,
+            recycle_after=RECYCLE_AFTER,
+            max_browser_mb=MAX_BROWSER_MB,
+            report_path=RUN_REPORT,
+            prometheus_path=RUN_REPORT_PROMETHEUS,
+            scheduler=scheduler,
+        ).run()
+        return
+    try:
+        if scheduler is not None and not scheduler.is_due():
+            logger.info("Skipping this run: restocks are unlikely right now and the last check was recent.")
+        else:
+            monitor.run_check()
+            monitor.report.write(RUN_REPORT, RUN_REPORT_PROMETHEUS)
+    finally:
+        monitor.close()
 
 
 if __name__ == "__main__":
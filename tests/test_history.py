@@ -0,0 +1,75 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from main import Observation, StockHistory
+
+
+class StockHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "history")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        observations = [
+            Observation(1700000000.0, "400001", "amul-paneer", True, 199.99, 12),
+            Observation(1700000000.0, "110001", "amul-lassi", False, None, None),
+            Observation(1700000060.0, "400001", "amul-paneer", False, 0.1, 0),
+        ]
+        StockHistory(self.directory).record(observations)
+        self.assertEqual(list(StockHistory(self.directory).iter_observations()), observations)
+
+    def test_appends_to_existing_segment_after_restart(self):
+        first = Observation(1700000000.0, "400001", "amul-paneer", True, 199.99, 12)
+        second = Observation(1700000060.0, "400001", "amul-lassi", True, 25.0, 3)
+        StockHistory(self.directory).record([first])
+        StockHistory(self.directory).record([second])
+        self.assertEqual(list(StockHistory(self.directory).iter_observations()), [first, second])
+
+    def test_torn_tail_is_dropped_before_appending(self):
+        first = Observation(1700000000.0, "400001", "amul-paneer", True, 199.99, 12)
+        second = Observation(1700000060.0, "400001", "amul-lassi", True, 25.0, 3)
+        StockHistory(self.directory).record([first])
+        (segment,) = os.listdir(self.directory)
+        with open(os.path.join(self.directory, segment), "ab") as f:
+            f.write(b"\x01\x00\x01")
+        StockHistory(self.directory).record([second])
+        self.assertEqual(list(StockHistory(self.directory).iter_observations()), [first, second])
+
+    def test_observation_with_undefined_id_is_skipped(self):
+        observation = Observation(1700000000.0, "400001", "amul-paneer", True, 199.99, 12)
+        StockHistory(self.directory).record([observation])
+        (segment,) = os.listdir(self.directory)
+        with open(os.path.join(self.directory, segment), "ab") as f:
+            f.write(struct.pack("<B", 1) + struct.pack("<IHHBdi", 1700000060, 0, 256, 1, 1.0, 1))
+        self.assertEqual(list(StockHistory(self.directory).iter_observations()), [observation])
+
+    def test_out_of_range_inventory_is_clamped(self):
+        history = StockHistory(self.directory)
+        history.record([Observation(1700000000.0, "400001", "a", True, 1.0, 1 << 40)])
+        history.record([Observation(1700000060.0, "400001", "b", True, 1.0, -5)])
+        inventories = [obs.inventory_quantity for obs in history.iter_observations()]
+        self.assertEqual(inventories, [(1 << 31) - 1, 0])
+
+    def test_failed_record_does_not_leave_undefined_ids(self):
+        history = StockHistory(self.directory)
+        with self.assertRaises(struct.error):
+            history.record([Observation(-1.0, "400001", "a", True, 1.0, 1)])
+        history.record([Observation(1700000000.0, "400001", "a", True, 1.0, 1)])
+        self.assertEqual([obs.alias for obs in history.iter_observations()], ["a"])
+
+    def test_rolls_over_before_string_ids_run_out(self):
+        history = StockHistory(self.directory)
+        history._MAX_IDS = 4
+        history.record([Observation(1700000000.0, "p", alias, True, 1.0, 1) for alias in "abc"])
+        history.record([Observation(1700000060.0, "p", alias, True, 1.0, 1) for alias in "de"])
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual([obs.alias for obs in history.iter_observations()], list("abcde"))
+
+
+if __name__ == "__main__":
+    unittest.main()